@@ -0,0 +1,159 @@
+#Description: Batch mode shared by nw_align.py and sw_align.py. Every record of one multi fasta file is aligned against every other record (or every
+#             record of a second file, or only the pairs listed in a pair file) on a pool of worker processes. The sequences are copied once into a
+#             shared memory block that the workers read from, so only the pair indices are sent with each task. Results are written as a TSV
+#             (id1, id2, score, start1, end1, start2, end2, identity) in the order the tasks complete
+
+import multiprocessing
+from multiprocessing import shared_memory
+import sys
+
+#number of pairs sent to a worker at once
+BATCH_CHUNK = 16
+
+#values set in every worker process by init_worker
+worker_memory = None
+worker_offsets = None
+worker_align = None
+
+#helper function to read every record of a multi fasta file, yields (sequence ID, sequence) tuples where the ID is the first word of the header
+def read_records(path):
+    seq_id = None
+    lines = []
+    file = open(path,'r')
+    for line in file:
+        line = line.rstrip('\n')
+        if line.startswith('>'):
+            if seq_id != None:
+                yield (seq_id,''.join(lines))
+            words = line[1:].split()
+            seq_id = words[0] if len(words) > 0 else ''
+            lines = []
+        elif seq_id != None:
+            lines.append(line.strip())
+    file.close()
+    if seq_id != None:
+        yield (seq_id,''.join(lines))
+
+#helper function to copy all sequences into one shared memory block, returns the block and a list with the (begin, end) position of every sequence
+def share_sequences(sequences):
+    data = ''.join(sequences).encode('latin-1')
+    memory = shared_memory.SharedMemory(create=True,size=max(1,len(data)))
+    memory.buf[:len(data)] = data
+    offsets = []
+    begin = 0
+    for i in sequences:
+        offsets.append((begin,begin+len(i)))
+        begin += len(i)
+    return (memory,offsets)
+
+#runs once in every worker, attaches the shared memory block and stores the alignment function
+def init_worker(memory_name,offsets,align_function):
+    global worker_memory, worker_offsets, worker_align
+    worker_memory = shared_memory.SharedMemory(name=memory_name)
+    worker_offsets = offsets
+    worker_align = align_function
+
+#helper function to read a sequence from the shared memory block, the empty character at the begining is added back like read_sequence does
+def get_shared_sequence(index):
+    begin,end = worker_offsets[index]
+    return ' ' + bytes(worker_memory.buf[begin:end]).decode('latin-1')
+
+#helper function to get the start and end coordinates (1 based, inclusive) and the identity of an alignment from get_alignment
+#the alignment list is in reverse order and every column is [seq2 character, notation, seq1 character]
+def summarize_alignment(alignment,end):
+    length1 = 0
+    length2 = 0
+    matches = 0
+    for i in alignment:
+        if i[2] != '-':
+            length1 += 1
+        if i[0] != '-':
+            length2 += 1
+        if i[1] == '|':
+            matches += 1
+    identity = matches/len(alignment) if len(alignment) > 0 else 0.0
+    return (end[0]-length1+1,end[0],end[1]-length2+1,end[1],identity)
+
+#helper function to turn an alignment from get_alignment into the dictionary returned by align_global and align_local, the aligned sequences include
+#the gaps and the notation line has '|' for matches and '*' for mismatches
+def alignment_to_dict(alignment,score,end):
+    start1,end1,start2,end2,identity = summarize_alignment(alignment,end)
+    return {'score':int(score),
+            'aligned1':''.join(i[2] for i in reversed(alignment)),
+            'notation':''.join(i[1] for i in reversed(alignment)),
+            'aligned2':''.join(i[0] for i in reversed(alignment)),
+            'start1':start1,'end1':end1,'start2':start2,'end2':end2,
+            'identity':identity}
+
+#aligns one pair of sequences in a worker, task is a tuple with the index of both sequences in the shared memory block, returns None when the
+#alignment function skipped the pair
+def align_task(task):
+    i,j = task
+    result = worker_align(get_shared_sequence(i),get_shared_sequence(j))
+    if result == None:
+        return None
+    alignment,score,end = result
+    return (i,j,score) + summarize_alignment(alignment,end)
+
+#helper function to generate the pairs of sequence indices to align. With one file every record is paired with every later record, with 2 files every
+#record of the first file is paired with every record of the second one, and with a pair file only the listed ID pairs are used
+def get_pairs(ids,count1,pairs_path=None):
+    if pairs_path != None:
+        index1 = {}
+        index2 = {}
+        for i in range(0,len(ids)):
+            if i < count1:
+                index1.setdefault(ids[i],i)
+            if i >= count1 or count1 == len(ids):
+                index2.setdefault(ids[i],i)
+        file = open(pairs_path,'r')
+        for line in file:
+            words = line.split()
+            if len(words) < 2:
+                continue
+            if words[0] not in index1 or words[1] not in index2:
+                print('Skipping pair with unknown sequence ID: '+words[0]+' '+words[1],file=sys.stderr)
+                continue
+            yield (index1[words[0]],index2[words[1]])
+        file.close()
+    elif count1 == len(ids):
+        for i in range(0,count1):
+            for j in range(i+1,count1):
+                yield (i,j)
+    else:
+        for i in range(0,count1):
+            for j in range(count1,len(ids)):
+                yield (i,j)
+
+#aligns all pairs of records from 1 or 2 multi fasta files with align_function on a pool of workers and writes a TSV line for each pair as it completes
+#align_function gets 2 sequences (with the empty character at the begining) and returns (alignment, score, (end in seq1, end in seq2)) or None to
+#leave the pair out of the TSV
+def run_batch(align_function,path1,path2=None,pairs_path=None,workers=None,out=sys.stdout):
+    ids = []
+    sequences = []
+    for seq_id,sequence in read_records(path1):
+        ids.append(seq_id)
+        sequences.append(sequence)
+    count1 = len(ids)
+    if path2 != None:
+        for seq_id,sequence in read_records(path2):
+            ids.append(seq_id)
+            sequences.append(sequence)
+
+    memory,offsets = share_sequences(sequences)
+    del sequences #the sequences now only live in the shared memory block
+    try:
+        out.write('#id1\tid2\tscore\tstart1\tend1\tstart2\tend2\tidentity\n')
+        pool = multiprocessing.Pool(workers,initializer=init_worker,initargs=(memory.name,offsets,align_function))
+        try:
+            for result in pool.imap_unordered(align_task,get_pairs(ids,count1,pairs_path),BATCH_CHUNK):
+                if result == None:
+                    continue #pair skipped by the alignment function
+                i,j,score,start1,end1,start2,end2,identity = result
+                out.write(ids[i]+'\t'+ids[j]+'\t'+str(score)+'\t'+str(start1)+'\t'+str(end1)+'\t'+str(start2)+'\t'+str(end2)+'\t'+'%.4f' % identity+'\n')
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        memory.close()
+        memory.unlink()
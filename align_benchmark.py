@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+#Description: Benchmark of the nw_align.py and sw_align.py engines on reproducible synthetic sequence pairs. The pairs are generated from a seed for
+#             every combination of length, identity, indel rate and alphabet (DNA or protein), then every engine aligns every pair in a fresh process
+#             so the peak RSS of one run is not hidden by an earlier one. Wall time, cells per second, peak RSS and agreement of the score with the
+#             original nested list grid engine (the reference, only run when the grid is small enough) are written as JSON
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import numpy as np
+import nw_align
+import sw_align
+
+#alphabets the synthetic sequences are drawn from
+ALPHABETS = {'dna':'ACGT','protein':'ACDEFGHIKLMNPQRSTVWY'}
+
+#engines of each aligner, every engine gets 2 plain sequence strings and returns the score (None when the pair was skipped)
+ENGINES = {
+    'nw':{
+        'numpy':lambda seq1,seq2: nw_align.align_global(seq1,seq2,engine='numpy')['score'],
+        'grid':lambda seq1,seq2: nw_align.align_global(seq1,seq2,engine='grid')['score'],
+        'linear':lambda seq1,seq2: nw_align.align_global(seq1,seq2,linear_memory=True)['score'],
+        'banded':lambda seq1,seq2: nw_align.align_global(seq1,seq2,band='auto')['score'],
+    },
+    'sw':{
+        'numpy':lambda seq1,seq2: sw_align.align_local(seq1,seq2,engine='numpy')['score'],
+        'striped':lambda seq1,seq2: sw_align.align_local(seq1,seq2,engine='striped')['score'],
+        'stream':lambda seq1,seq2: sw_align.align_local(seq1,seq2,engine='stream')['score'],
+        'grid':lambda seq1,seq2: sw_align.align_local(seq1,seq2,engine='grid')['score'],
+        'prefilter':lambda seq1,seq2: get_prefilter_score(seq1,seq2),
+    },
+}
+
+#largest number of cells the nested list grid engine is run on (as a benchmarked engine and as the reference)
+GRID_MAX_CELLS = 1<<20
+
+#helper function for the seed prefilter engine, only the score is computed like sw_align.py -s -f
+def get_prefilter_score(seq1,seq2):
+    start = sw_align.seeded_score(' ' + seq1,' ' + seq2)
+    return None if start == None else start[0]
+
+#helper function to generate one pair, the second sequence is a copy of the first one with substitutions (1 - identity of the positions) and
+#insertions and deletions (each at the indel rate per position). The generator is seeded from the seed and the pair settings so every pair is
+#reproducible on its own
+def generate_pair(seed,length,identity,indel_rate,alphabet):
+    rand = random.Random('%d-%d-%s-%s-%s' % (seed,length,identity,indel_rate,alphabet))
+    letters = ALPHABETS[alphabet]
+    seq1 = ''.join(rand.choice(letters) for i in range(0,length))
+    seq2 = []
+    for c in seq1:
+        if rand.random() < indel_rate:
+            seq2.append(rand.choice(letters)) #insertion before the position
+        if rand.random() < indel_rate:
+            continue #deletion of the position
+        if rand.random() >= identity:
+            c = rand.choice(letters.replace(c,''))
+        seq2.append(c)
+    return (seq1,''.join(seq2))
+
+#helper function to get the peak RSS of the current process in KB (ru_maxrss is in bytes on macOS)
+def get_peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak//1024 if sys.platform == 'darwin' else peak
+
+#runs one engine on one pair, called in a fresh process. Returns the score, the wall time and the peak RSS before and after the alignment
+def run_engine(aligner,engine,seq1,seq2):
+    baseline = get_peak_rss()
+    begin = time.perf_counter()
+    score = ENGINES[aligner][engine](seq1,seq2)
+    wall = time.perf_counter() - begin
+    return (score,wall,baseline,get_peak_rss())
+
+#helper function to run one engine in a new process (spawned so it does not start with the memory of the benchmark process)
+def run_isolated(aligner,engine,seq1,seq2):
+    with concurrent.futures.ProcessPoolExecutor(1,mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_engine,aligner,engine,seq1,seq2).result()
+
+#helper function to split a comma separated command line list
+def split_list(value,convert=str):
+    return [convert(i) for i in value.split(',') if i != '']
+
+#runs every engine on every pair and returns the JSON report, progress is printed to stderr
+def run_benchmark(seed,lengths,identities,indel_rates,alphabets,aligners,engines=None):
+    results = []
+    for alphabet in alphabets:
+        for length in lengths:
+            for identity in identities:
+                for indel_rate in indel_rates:
+                    seq1,seq2 = generate_pair(seed,length,identity,indel_rate,alphabet)
+                    cells = len(seq1)*len(seq2)
+                    for aligner in aligners:
+                        reference = None
+                        if cells <= GRID_MAX_CELLS:
+                            reference = ENGINES[aligner]['grid'](seq1,seq2)
+                        for engine in ENGINES[aligner]:
+                            if engines != None and engine not in engines:
+                                continue
+                            if engine == 'grid' and cells > GRID_MAX_CELLS:
+                                continue
+                            score,wall,baseline,peak = run_isolated(aligner,engine,seq1,seq2)
+                            results.append({'aligner':aligner,'engine':engine,'alphabet':alphabet,'length1':len(seq1),'length2':len(seq2),
+                                            'identity':identity,'indel_rate':indel_rate,'cells':cells,'wall_seconds':wall,
+                                            'cells_per_second':cells/wall if wall > 0 else None,'peak_rss_kb':peak,'baseline_rss_kb':baseline,
+                                            'score':score,'reference_score':reference,
+                                            'agrees':None if reference == None or score == None else score == reference})
+                            print(aligner,engine,alphabet,len(seq1),len(seq2),'%.3fs' % wall,'score',score,'reference',reference,file=sys.stderr)
+    return {'seed':seed,'python':platform.python_version(),'numpy':np.__version__,'platform':platform.platform(),
+            'grid_max_cells':GRID_MAX_CELLS,'results':results}
+
+if __name__ == '__main__':
+    #parses the pair settings, the engines to run and the output file
+    parser = argparse.ArgumentParser(description="Benchmark of the Needleman-Wunsch and Smith-Waterman engines on synthetic sequence pairs")
+    parser.add_argument('-s','--seed',type=int,default=1,help='Enter the seed of the synthetic pairs (Default 1)')
+    parser.add_argument('-l','--lengths',type=str,default='100,1000,10000,50000',help='Enter the comma separated lengths of the first sequence of each pair (Default 100,1000,10000,50000)')
+    parser.add_argument('-i','--identities',type=str,default='0.9',help='Enter the comma separated identities (fraction of positions without substitution, Default 0.9)')
+    parser.add_argument('-g','--indel-rates',type=str,default='0.02',help='Enter the comma separated insertion and deletion rates per position (Default 0.02)')
+    parser.add_argument('-a','--alphabets',type=str,default='dna,protein',help='Enter the comma separated alphabets <dna> and/or <protein> (Default both)')
+    parser.add_argument('-n','--aligners',type=str,default='nw,sw',help='Enter the comma separated aligners <nw> and/or <sw> (Default both)')
+    parser.add_argument('-e','--engines',type=str,help='Enter the comma separated engines to run (Default every engine of the aligners)')
+    parser.add_argument('-o','--output',type=str,help='Enter the JSON output file (Default prints to console)')
+
+    args = parser.parse_args()
+
+    #checks the lists before the first pair is generated
+    try:
+        lengths = split_list(args.lengths,int)
+        identities = split_list(args.identities,float)
+        indel_rates = split_list(args.indel_rates,float)
+    except ValueError:
+        print('Lengths must be integers and identities and indel rates numbers!')
+        exit(1)
+    alphabets = split_list(args.alphabets)
+    aligners = split_list(args.aligners)
+    engines = split_list(args.engines) if args.engines != None else None
+    if any(i not in ALPHABETS for i in alphabets) or any(i not in ENGINES for i in aligners):
+        print('Invalid alphabet or aligner, alphabets are <dna> or <protein> and aligners <nw> or <sw>!')
+        exit(1)
+    if any(i < 1 for i in lengths) or any(i < 0 or i > 1 for i in identities + indel_rates):
+        print('Lengths must be positive and identities and indel rates between 0 and 1!')
+        exit(1)
+
+    report = run_benchmark(args.seed,lengths,identities,indel_rates,alphabets,aligners,engines)
+    out = open(args.output,'w') if args.output != None else sys.stdout
+    json.dump(report,out,indent=2)
+    out.write('\n')
+    if out != sys.stdout:
+        out.close()
@@ -0,0 +1,97 @@
+#Description: Alignment server shared by nw_align.py and sw_align.py (--serve mode). It listens on a Unix domain socket and answers JSON lines, one
+#             response line per request line. A request is either one pair {"id": ..., "seq1": "ACGT", "seq2": "AGT", ...} or a batch
+#             {"pairs": [pair, pair, ...]}. Any other key of a pair is passed to the alignment function as a keyword argument (for example "engine").
+#             A pair is answered with the dictionary align_global/align_local return (plus its id) or {"error": message}, a batch with
+#             {"results": [...]} in the same order as the pairs. The worker processes are started once and stay warm between requests and connections
+
+import json
+import multiprocessing
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+
+#number of pairs of a batch sent to a worker at once
+SERVER_CHUNK = 16
+
+#alignment function set in every worker process by init_worker
+worker_align = None
+
+#runs once in every worker, stores the alignment function. Ctrl-C is left to the server process which shuts the pool down
+def init_worker(align_function):
+    global worker_align
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    worker_align = align_function
+
+#aligns one pair request in a worker, errors are returned as a result instead of stopping the batch
+def align_request(request):
+    if not isinstance(request,dict):
+        return {'error':'Pair must be a JSON object'}
+    if not isinstance(request.get('seq1'),str) or not isinstance(request.get('seq2'),str):
+        result = {'error':'Pair must have the seq1 and seq2 strings'}
+    else:
+        options = {}
+        for key in request:
+            if key not in ('id','seq1','seq2'):
+                options[key] = request[key]
+        try:
+            result = worker_align(request['seq1'],request['seq2'],**options)
+        except Exception as error:
+            result = {'error':type(error).__name__+': '+str(error)}
+    if 'id' in request:
+        result['id'] = request['id']
+    return result
+
+#handles one connection, requests are answered in order until the client closes the connection
+class AlignHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                response = {'error':'Invalid JSON: '+str(error)}
+            else:
+                if isinstance(request,dict) and 'pairs' in request:
+                    if isinstance(request['pairs'],list):
+                        response = {'results':self.server.pool.map(align_request,request['pairs'],SERVER_CHUNK)}
+                    else:
+                        response = {'error':'pairs must be a list'}
+                else:
+                    response = self.server.pool.apply(align_request,(request,))
+            self.wfile.write((json.dumps(response)+'\n').encode('utf-8'))
+            self.wfile.flush()
+
+#one thread per connection, all threads share the pool of worker processes
+class AlignServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+#starts the pool of workers and serves requests on the Unix socket until Ctrl-C or SIGTERM, a stale socket file left by a previous server is replaced
+#the socket file is removed when the server stops
+def serve(socket_path,align_function,workers=None):
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            print(socket_path+' exists and is not a socket!')
+            exit(1)
+        os.remove(socket_path)
+    pool = multiprocessing.Pool(workers,initializer=init_worker,initargs=(align_function,))
+    server = AlignServer(socket_path,AlignHandler)
+    server.pool = pool
+    #SIGTERM stops serve_forever like Ctrl-C, shutdown waits for the serving loop so it is called from another thread than the signal handler
+    previous_handler = signal.signal(signal.SIGTERM,lambda signum,frame: threading.Thread(target=server.shutdown,daemon=True).start())
+    print('Listening on '+socket_path,file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM,previous_handler)
+        server.server_close()
+        pool.terminate()
+        pool.join()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,75 @@
+#Description: Compact traceback matrix shared by nw_align.py and sw_align.py. The direction each cell came from (Diagonal, Up, Left) is stored as a
+#             2 bit code (4 cells per byte) in a NumPy uint8 array instead of a [score, direction] list per cell. The matrix can be indexed like the
+#             nested list grid (grid[y][x] returns [score, direction]) so get_alignment in both scripts works on it unchanged
+
+import numpy as np
+
+#direction codes stored in the matrix, the index of each code maps to the direction character used in the grid ('' for no direction)
+NONE, DIAG, UP, LEFT = 0, 1, 2, 3
+DIRECTIONS = ('', 'D', 'U', 'L')
+
+#bits used per cell, 2 bits hold the 4 direction codes (4 bits leaves room for extra state such as an affine gap flag)
+BITS = 2
+
+#traceback matrix with the direction codes of rows x width cells packed into bytes. For banded grids each row only stores width cells starting at
+#the column saved in offsets while cols is the number of columns of the full grid. Scores are only kept for the cells saved in the scores dictionary
+#(the cell the traceback starts at) since get_alignment does not need any other score
+class PackedTraceback:
+    def __init__(self, rows, width, cols=None, banded=False, bits=BITS):
+        self.bits = bits
+        self.per_byte = 8//bits #number of cells stored in each byte
+        self.mask = (1<<bits)-1
+        self.width = width
+        self.cols = width if cols == None else cols
+        self.packed = np.zeros((rows,-(-width//self.per_byte)),dtype=np.uint8)
+        self.offsets = np.zeros(rows,dtype=np.int64) if banded else None
+        self.scores = {} #dictionary with (y,x) coordinates as key and the score of that cell as value
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+    def __getitem__(self, y):
+        return PackedRow(self, y)
+
+    #stores the direction codes of a whole row, for banded grids offset is the column of the first code
+    def set_row(self, y, codes, offset=0):
+        cells = np.zeros(self.packed.shape[1]*self.per_byte,dtype=np.uint8)
+        cells[:len(codes)] = codes
+        cells = cells.reshape(-1,self.per_byte)
+        row = cells[:,0].copy()
+        for i in range(1,self.per_byte):
+            row |= cells[:,i] << (self.bits*i) #each cell of a byte is shifted into its own bits
+        self.packed[y] = row
+        if self.offsets is not None:
+            self.offsets[y] = offset
+
+    #returns the direction codes of all stored cells of a row
+    def get_row(self, y):
+        cells = np.empty((self.packed.shape[1],self.per_byte),dtype=np.uint8)
+        for i in range(0,self.per_byte):
+            cells[:,i] = (self.packed[y] >> (self.bits*i)) & self.mask
+        return cells.reshape(-1)[:self.width]
+
+    #returns the direction code of one cell, cells outside of the band have no direction
+    def get_code(self, y, x):
+        if self.offsets is not None:
+            x -= self.offsets[y]
+            if x < 0 or x >= self.width:
+                return NONE
+        return (int(self.packed[y,x//self.per_byte]) >> (self.bits*(x%self.per_byte))) & self.mask
+
+    #number of bytes used by the packed direction codes
+    def nbytes(self):
+        return self.packed.nbytes
+
+#single row of a PackedTraceback, indexing it returns the [score, direction] list of a cell like the nested list grid
+class PackedRow:
+    def __init__(self, matrix, y):
+        self.matrix = matrix
+        self.y = y
+
+    def __len__(self):
+        return self.matrix.cols
+
+    def __getitem__(self, x):
+        return [self.matrix.scores.get((self.y,x)),DIRECTIONS[self.matrix.get_code(self.y,x)]]
@@ -1,16 +1,38 @@
 #!/usr/bin/env python3 
 import argparse
+import concurrent.futures
+import glob
+import io
+import itertools
+import os
 import re
+import struct
+import sys
+import tempfile
+import numpy as np
+import bgzf
 
 #Description: This program converts any relevant sequence from a varienty of file types to a fasta format. The extension of the input files does not matter as the program
 #             scans for content instead. The program also allows you to enter the fold number.
 
-#parses the fold and input file arguments
-parser = argparse.ArgumentParser(description="Convert any sequence relevant file type to fasta format")
-parser.add_argument('-f',metavar='--fold',type=int,default=70,help='Enter the fold number (How many nucleotides/amino acids to display per line-Default 70)')
-parser.add_argument('-i',metavar='--input',type=str,help='Enter the input file to convert to fasta format')
+#number of characters at the begining of the file the sniffers look at to detect its type
+DETECT_BYTES = 1<<16
+#number of records read before the first one is written in streaming mode, the sequence type is decided from them
+SAMPLE_RECORDS = 1000
+#size of the read buffer of the input file
+READ_BUFFER = 1<<20
+#number of bytes of folded records collected before they are written to the output file
+WRITE_BUFFER = 1<<22
+#extensions of compressed input files, removed before the format extension when the output is named
+COMPRESSION_PATTERN = re.compile(r'\.(gz|bgz|bgzf)$',re.IGNORECASE)
 
-args = parser.parse_args()
+#fixed part of a BAM alignment record after the block size: refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen
+BAM_RECORD = struct.Struct('<iiBBHHHiiii')
+#4 bit base codes of BAM sequences, every packed byte is decoded to its 2 bases at once with a 256 x 2 lookup table
+BAM_BASES = '=ACMGRSVTWYHKDBN'
+BAM_BASE_PAIRS = np.array([[ord(i),ord(j)] for i in BAM_BASES for j in BAM_BASES],dtype=np.uint8)
+#complement of every base code for reverse strand reads
+COMPLEMENT = bytes.maketrans(b'=ACMGRSVTWYHKDBN',b'=TGKCYSBAWRDMHVN')
 
 #helper function to check if either arguments are valid by passing a list of boolean values
 def arg_check(valid):
@@ -19,38 +41,70 @@ def arg_check(valid):
             print("Terminating program!") #if one of the arguments is invalid ther the program terminates
             exit(1)
 
-#helperf function to detect the file type by scanning the file contents with the help of regex expressions
+#patterns used by the sniffers, compiled once and only run on the first DETECT_BYTES of the file
+SAM_HEADER_PATTERN = re.compile(r'^@(HD|SQ|RG|PG|CO)\t')
+MEGA_PATTERN = re.compile(r'^#mega',re.IGNORECASE)
+EMBL_PATTERN = re.compile(r'^ID(   |\s)')
+GENEBANK_PATTERN = re.compile(r'^LOCUS\s')
+VCF_PATTERN = re.compile(r'^##fileformat=VCF')
+GFF3_PATTERN = re.compile(r'^##gff-version\s+3')
+PHYLIP_PATTERN = re.compile(r'^\s*[0-9]+\s+[0-9]+\s*$')
+
+#sniffers, each one gets the lines at the begining of the file and returns the confidence (0 to 1) that the file has its format
+#fastq entries are 4 lines with a + line, a first line starting with @ alone could also be a sam header
+def sniff_fastq(lines):
+    if not lines[0].startswith('@') or SAM_HEADER_PATTERN.match(lines[0]):
+        return 0.0
+    return 1.0 if len(lines) > 2 and lines[2].startswith('+') else 0.5
+
+#sam files start with header lines (@HD, @SQ, ...) or directly with an alignment line of at least 11 columns
+def sniff_sam(lines):
+    if SAM_HEADER_PATTERN.match(lines[0]):
+        return 1.0
+    columns = lines[0].split('\t')
+    return 0.8 if len(columns) >= 11 and columns[1].isdigit() and columns[3].isdigit() else 0.0
+
+def sniff_mega(lines):
+    return 1.0 if MEGA_PATTERN.match(lines[0]) else 0.0
+
+def sniff_embl(lines):
+    match = EMBL_PATTERN.match(lines[0])
+    if match == None:
+        return 0.0
+    return 1.0 if match.group(1) == '   ' else 0.6
+
+def sniff_genebank(lines):
+    return 1.0 if GENEBANK_PATTERN.match(lines[0]) else 0.0
+
+def sniff_vcf(lines):
+    return 1.0 if VCF_PATTERN.match(lines[0]) else 0.0
+
+def sniff_fasta(lines):
+    return 1.0 if lines[0].startswith('>') else 0.0
+
+def sniff_gff3(lines):
+    return 1.0 if GFF3_PATTERN.match(lines[0]) else 0.0
+
+#phylip files start with the number of sequences and the number of sites
+def sniff_phylip(lines):
+    return 0.9 if PHYLIP_PATTERN.match(lines[0]) else 0.0
+
+#helper function to get the confidence of every registered format for the begining of a file, only the first DETECT_BYTES characters are scanned
+def sniff_formats(content):
+    lines = content[:DETECT_BYTES].split('\n')
+    confidence = {}
+    for i in FORMATS:
+        confidence[i] = FORMATS[i][0](lines)
+    return confidence
+
+#helper function to detect the file type from the begining of the file contents, the format with the highest confidence wins (the first
+#registered one on a tie) and None is returned when no format matches
 def detect_file_type(content):
-    #regex expression for fastq content including the @ followed by any non white space character
-    fastq_pattern = r'^@[^\s]*\n'
-    #regex expression for sam content that includes a bunch of lines starting with @ and at least one of them is followed by the SQ and PG flag 
-    sam_pattern = r'^(@[^\s].*\n)*(@SQ.*\n)(@[^\s].*\n)*(@PG.*\n)|^(@[^\s].*\n)*(@PG.*\n)(@[^\s].*\n)*(@SQ.*\n)'
-    #regex expression for mega content scanning for the mega header
-    mega_pattern = r'^#MEGA\s*|^#mega\s*\n'
-    #regex expression for embl content scanning for the ID label at the begining of the file
-    embl_pattern = r'^ID\s*.*\n'
-    #regex expression for genebank content scanning for the LOCUS label at the begining of the file
-    genebank_pattern = r'^LOCUS\s*.*\n'
-    #regex expression for vcf content scanning for the ##fileformat=VCF header at the begining of the file
-    vcf_pattern = r'^##fileformat=VCF.*\n'
-    #store regex patterns in a list
-    patterns = [fastq_pattern,sam_pattern,mega_pattern,embl_pattern,genebank_pattern,vcf_pattern]
-    j = -1 
-    #loop scans for match in patterns list, if found j will have the index value of that last with the matched pattern
-    for i in range(0,len(patterns)):
-        if re.match(patterns[i],content):
-            j = i
-
-    #switch statement based on the value of j derived from the patterns list
-    switch={
-        0:'fastq',
-        1:'sam',
-        2:'mega',
-        3:'embl',
-        4:'genebank',
-        5:'vcf'
-    }
-    file_type = switch.get(j) #this detects the appropriate file type
+    confidence = sniff_formats(content)
+    file_type = None
+    for i in confidence:
+        if confidence[i] > 0 and (file_type == None or confidence[i] > confidence[file_type]):
+            file_type = i
     return file_type #returns the file type as a string
 
 #helper function that helps scan though the file contonet and extract the sequences along with their names based on the file type
@@ -157,108 +211,540 @@ def parse_content(content,file_type):
                 seq[seq_id] = sequence
     #if file type is vcf
     elif file_type == 'vcf':
-        sample_list = [] #stores the number of samples (including extra entry for reference genome)
-        ref_sequence = [] #stores the whole reference sequence in segments
-        alt_sequence = [] #stores the whole alternate sequence in segments
-        sample_info = [] #stores info about samples (which portions refere to reference and alternate sequence. It is a 2D list)
-        added_seq = False #checks if extra entry for reference sample has been added to sample list later in the loop
+        #the genotypes of all samples are decoded into one matrix and every sample sequence is gathered from the allele tables
+        for seq_id,sequence in parse_vcf(content):
+            seq[seq_id] = sequence
+    #formats without their own branch (fasta, gff3, phylip) use their streaming parser
+    elif file_type in FORMATS:
+        for seq_id,sequence in FORMATS[file_type][1](content):
+            seq[seq_id] = sequence
+    return seq #returns the dictionary with the sequence names and respective sequences
 
-        #loop scans the contents
-        for i in content:
-            if re.match(r'^#CHROM.*',i):
-                #if you are at column titles it extracts all samples and separates them based on the tab-delimeter
-                i = re.sub(r'(^#CHROM.*FORMAT\t)(.*)',r'\2',i)
-                sample_list = i.split('\t')
+#helper function to iterate over the lines of an open file without the new line characters (same lines as content.split('\n'))
+def read_lines(file):
+    for line in file:
+        if line.endswith('\n'):
+            line = line[:-1]
+        yield line
+
+#streaming fastq parser, yields a (sequence ID, sequence) tuple for every 4 line entry
+def parse_fastq(lines):
+    j = 0 #keeps track of the line number inside the entry
+    seq_id = ''
+    for i in lines:
+        if len(i) != 0:
+            if j == 0:
+                seq_id = i[1:] #first line of the entry is the sequence name
+            if j == 1:
+                yield (seq_id,i) #second line of the entry is the sequence
+            j += 1
+            if j == 4:
+                j = 0
+
+#streaming sam parser, yields the first (read name) and 10th (sequence) column of every alignment line
+def parse_sam(lines):
+    for i in lines:
+        if re.match(r'^[^@].*',i):
+            seq_id = re.sub(r'^([^\s]*)(\s*.*)',r'\1',i)
+            sequence = re.sub(r'^([^\s]*\s*){9}([^\s]*)(\s*.*)',r'\2',i)
+            yield (seq_id,sequence)
+
+#helper function to check if a file is a BAM file (BGZF or gzip compressed data starting with the BAM magic bytes)
+def is_bam(path,threads=None):
+    if bgzf.get_compression(path) == None:
+        return False
+    file = bgzf.open_binary(path,threads)
+    magic = file.read(4)
+    file.close()
+    return magic == b'BAM\x01'
+
+#streaming BAM parser, file is the decompressed binary stream. The header and reference list are skipped and every alignment record is decoded with
+#struct from its block, the flag and MAPQ filters are checked on the fixed part of the record so filtered reads are never decoded. The 4 bit packed
+#sequence is decoded with BAM_BASE_PAIRS and reads on the reverse strand (flag 16) are reverse complemented back to the sequenced strand when
+#reverse_complement is set. Yields (read name, sequence) like parse_sam ('*' when the record has no sequence)
+def parse_bam(file,include_flags=0,exclude_flags=0,min_mapq=0,reverse_complement=False):
+    if file.read(4) != b'BAM\x01':
+        raise ValueError('Invalid BAM file, the BAM magic bytes are missing')
+    text_length = struct.unpack('<i',file.read(4))[0]
+    file.read(text_length) #header text
+    for i in range(0,struct.unpack('<i',file.read(4))[0]):
+        name_length = struct.unpack('<i',file.read(4))[0]
+        file.read(name_length+4) #reference name and length
+    while True:
+        size = file.read(4)
+        if len(size) == 0:
+            break
+        if len(size) < 4:
+            raise ValueError('Truncated BAM record')
+        size = struct.unpack('<i',size)[0]
+        data = file.read(size)
+        if len(data) < size:
+            raise ValueError('Truncated BAM record')
+        _,_,name_length,mapq,_,cigar_count,flag,seq_length,_,_,_ = BAM_RECORD.unpack_from(data,0)
+        if flag & include_flags != include_flags or flag & exclude_flags != 0 or mapq < min_mapq:
+            continue
+        name = data[32:32+name_length-1].decode('latin-1') #read name without the NUL at the end
+        if seq_length == 0:
+            yield (name,'*')
+            continue
+        packed = np.frombuffer(data,dtype=np.uint8,count=(seq_length+1)//2,offset=32+name_length+4*cigar_count)
+        bases = BAM_BASE_PAIRS[packed].tobytes()[:seq_length]
+        if reverse_complement and flag & 16:
+            bases = bases.translate(COMPLEMENT)[::-1]
+        yield (name,bases.decode('ascii'))
+
+#streaming embl parser, the name and sequence are built like parse_content does and a record is yielded at every // line
+def parse_embl(lines):
+    seq_id = ''
+    sequence = []
+    found_sequence = False
+    for i in lines:
+        if re.match(r'^//',i):
+            yield (seq_id,re.sub(r'[^A-Za-z]','',''.join(sequence)))
+            seq_id = ''
+            sequence = []
+            found_sequence = False
+            continue
+        if re.match(r'^ID\s*.*',i):
+            seq_id += i
+            seq_id = re.sub(r'([^\s]*\s*)([A-Za-z0-9]*)(;\s*)(SV\s*)([0-9]*)(;.*)',r'ENA|\2|\2.\5 ',seq_id)
+        if re.match(r'^DE\s*.*',i):
+            seq_id += re.sub(r'(DE\s*)(.*)',r'\2',i)
+        if re.match(r'^SQ\s*',i):
+            found_sequence = True
+            continue
+        if found_sequence == True:
+            sequence.append(i)
+    if found_sequence == True or seq_id != '':
+        yield (seq_id,re.sub(r'[^A-Za-z]','',''.join(sequence))) #last record without a // line
+
+#streaming genebank parser, the name and sequence are built like parse_content does and a record is yielded at every // line
+def parse_genebank(lines):
+    seq_id = ''
+    sequence = []
+    found_sequence = False
+    for i in lines:
+        if re.match(r'^//',i):
+            yield (seq_id,re.sub(r'[^A-Za-z]','',''.join(sequence)))
+            seq_id = ''
+            sequence = []
+            found_sequence = False
+            continue
+        if re.match(r'^VERSION\s*.*',i):
+            seq_id = re.sub(r'(VERSION\s*)([^\s]*)',r'\2',i) + ' ' + seq_id
+        if re.match(r'^DEFINITION\s*.*',i):
+            seq_id += re.sub(r'^(DEFINITION\s*)(.*)',r'\2',i)
+        if re.match(r'^ORIGIN\s*',i):
+            found_sequence = True
+            continue
+        if found_sequence == True:
+            sequence.append(i)
+    if found_sequence == True or seq_id != '':
+        yield (seq_id,re.sub(r'[^A-Za-z]','',''.join(sequence))) #last record without a // line
+
+#mega records are only complete at the end of the file (interleaved blocks), so the streaming parser reads the whole file with parse_content and
+#yields its records
+def parse_mega(lines):
+    yield from parse_content(list(lines),'mega').items()
+
+#helper function to decode the GT field of every sample of one vcf record into a row of allele numbers (ploidy numbers per sample, -1 for a missing
+#allele). The fast path splits all genotypes at once, genotypes with another ploidy are padded with their last allele or cut to the ploidy
+def decode_genotypes(fields,gt_index,ploidy):
+    genotypes = []
+    for i in fields:
+        genotypes.append(i.split(':')[gt_index] if gt_index > 0 else i.split(':',1)[0])
+    text = '\t'.join(genotypes).replace('|','\t').replace('/','\t')
+    alleles = text.split('\t')
+    if len(alleles) != len(genotypes)*ploidy:
+        alleles = []
+        for i in genotypes:
+            sample = re.split(r'[|/]',i)
+            alleles += (sample + [sample[-1]]*ploidy)[:ploidy]
+    return [int(i) if i.isdigit() else -1 for i in alleles]
+
+#vcf engine, every record is split once and the GT fields of all samples are decoded into a matrix of allele numbers (variants x haplotypes).
+#Each haplotype sequence is then gathered in one step from a flat table holding the REF, ALT and missing ('N' for every REF base) allele of every
+#variant. Yields the reference record (named after the first chromosome, like the original parser) and then one record per sample, or one per
+#haplotype (sample_1, sample_2, ...) when the genotypes have more than one allele, phased (|) or unphased (/) genotypes keep the order they are written in
+def parse_vcf(lines):
+    sample_list = []
+    chrom = None
+    table = [] #REF, ALT and missing alleles of every variant one after the other
+    offsets = [] #position of the REF allele of every variant in table
+    counts = [] #number of REF and ALT alleles of every variant
+    rows = [] #allele numbers of every haplotype for every variant (16 bit rows of the genotype matrix)
+    ploidy = None
+    for i in lines:
+        if i.startswith('#CHROM'):
+            columns = i.split('\t')
+            sample_list = columns[9:] if len(columns) > 9 else []
+            continue
+        if len(i) == 0 or i.startswith('#'):
+            continue
+        fields = i.split('\t')
+        if chrom == None:
+            chrom = fields[0]
+        alleles = [fields[3]] + fields[4].split(',')
+        offsets.append(len(table))
+        counts.append(len(alleles))
+        table += alleles
+        table.append('N'*len(fields[3]))
+        if len(sample_list) > 0:
+            format_fields = fields[8].split(':')
+            gt_index = format_fields.index('GT') if 'GT' in format_fields else None
+            if gt_index == None:
+                rows.append(None) #no genotype, the samples keep the reference allele
                 continue
-            if re.match(r'^[^#].*',i):
-                #first entry after the column titles should contain the reference sample name and sets added_seq to true
-                added_seq = True
-                seq_id = re.sub(r'^([^\s]*)(\s*.*)',r'\1',i) #regex extacts the sequence name
-                if not (added_seq == True and seq_id == sample_list[0]):
-                    sample_list.insert(0,seq_id) #if reference sequence name is not added to sample list then add it at begining of list
-
-                #scans vertically in the file through each iteration to get the reference and alternate sequence segemtns and store them to their respecive lists
-                ref_sequence.append(re.sub(r'^([^\s]*\s*){3}([^\s]*)(\s*.*)',r'\2',i))
-                alt_sequence.append(re.sub(r'^([^\s]*\s*){4}([^\s]*)(\s*.*)',r'\2',i))
-                l = [] #will get each line that stores info about each sample at that specific location if they use the reference or alternate sequence segment
-                for j in range(1,len(sample_list)):
-                    re_str = '^([^\s]*\s*){'+str(j+8)+'}([0-9]*)(:\s*.*)' #regex string will be modified at every looop iteration to scan horizontialy amoing all the samples
-                    l.append(re.sub(re_str,r'\2',i)) #the needed info is added to temporary list l
-                sample_info.append(l) #list l is then appended to the 2D sample list
-        #there could be multiple alternative sequences if so then split them based on the ',' character
-        for i in range(0,len(alt_sequence)):
-            alt_sequence[i] = alt_sequence[i].split(',')
-        #extract the reference sequence and pair it with the reference sample name as you add it to dictionary accordingly
-        ref_seq = '' 
-        for i in ref_sequence:
-            ref_seq+=i
-        seq[sample_list[0]] = ref_seq
-        #nested for lop scans verically first for each sample and then moves horizationaly
-        for i in range(0,len(sample_info[0])):
-            seq_str = '' #set sequence to empty string
-            for j in range(0,len(sample_info)):
-                #scan vertically for each sample
-                if int(sample_info[j][i]) == 0:
-                    seq_str += ref_sequence[j] #if value is 0 in sample list then refer to reference sequence for that particular segment and add it to seq_str
-                else:
-                    seq_str += alt_sequence[j][int(sample_info[j][i])-1] #if value is 0 in sample list then refer to appropriate alternate sequence for that particular segment and add it to seq_str
-            seq[sample_list[i+1]] = seq_str #add the sample name and correctly extracted sequence to dictionary
-    return seq #returns the dictionary with the sequence names and respective sequences
+            if ploidy == None:
+                ploidy = max(len(re.split(r'[|/]',j.split(':')[gt_index])) for j in fields[9:9+len(sample_list)])
+            rows.append(np.array(decode_genotypes(fields[9:9+len(sample_list)],gt_index,ploidy),dtype=np.int16))
+    if chrom == None:
+        return
+    table = np.array(table,dtype=object)
+    yield (chrom,''.join(table[np.array(offsets,dtype=np.int64)].tolist()))
+    if len(sample_list) == 0:
+        return
+    ploidy = ploidy or 1
+    genotypes = np.array([j if j is not None else np.zeros(len(sample_list)*ploidy,dtype=np.int16) for j in rows],dtype=np.int16)
+    offsets = np.array(offsets,dtype=np.int64)
+    counts = np.array(counts,dtype=np.int64)
+    for j in range(0,len(sample_list)*ploidy):
+        column = genotypes[:,j]
+        column = np.where((column < 0) | (column >= counts),counts,column) #missing or invalid alleles point to the missing allele
+        name = sample_list[j//ploidy] if ploidy == 1 else sample_list[j//ploidy]+'_'+str(j%ploidy+1)
+        yield (name,''.join(table[offsets+column].tolist()))
 
-#scans the sequences in the dictionary to detect if it is an amino acid or nucleotided sequence
-def get_seq_type(seq_dict):
-    for i in seq_dict.values():
+#streaming fasta parser (passthrough), the whole header line is the sequence ID like the other formats
+def parse_fasta(lines):
+    seq_id = None
+    sequence = []
+    for i in lines:
+        if i.startswith('>'):
+            if seq_id != None:
+                yield (seq_id,''.join(sequence))
+            seq_id = i[1:]
+            sequence = []
+        elif seq_id != None:
+            sequence.append(''.join(i.split()))
+    if seq_id != None:
+        yield (seq_id,''.join(sequence))
+
+#streaming gff3 parser, the features are skipped and the sequences of the ##FASTA section at the end of the file are yielded
+def parse_gff3(lines):
+    lines = iter(lines)
+    for i in lines:
+        if i.startswith('##FASTA'):
+            yield from parse_fasta(lines)
+            return
+
+#phylip parser for sequential and interleaved files (strict 10 character names or relaxed names followed by white space). The file is interleaved when
+#the first sequence is shorter than the number of sites and a blank line follows the first n lines, the other blocks then continue the sequences in order
+def parse_phylip(lines):
+    lines = iter(lines)
+    header = next(lines,'').split()
+    if len(header) < 2:
+        return
+    count = int(header[0])
+    sites = int(header[1])
+    lines = list(lines)
+    rows = [i for i in lines if i.strip() != '']
+    names = []
+    sequences = []
+    #helper function to split a line with a name into the name and the sequence
+    def split_name(line):
+        if len(line) > 0 and not line[0].isspace() and re.match(r'^[^\s]+\s',line):
+            name,rest = line.split(None,1)
+        else:
+            name,rest = line[:10].strip(),line[10:]
+        return (name,''.join(rest.split()))
+    interleaved = False
+    if len(rows) > count:
+        first = split_name(rows[0])[1]
+        position = [j for j in range(0,len(lines)) if lines[j].strip() != ''][count-1] if count > 0 else 0
+        interleaved = len(first) < sites and position+1 < len(lines) and lines[position+1].strip() == ''
+    if interleaved:
+        for i in rows[:count]:
+            name,sequence = split_name(i)
+            names.append(name)
+            sequences.append([sequence])
+        for i in range(count,len(rows)):
+            sequences[(i-count)%count].append(''.join(rows[i].split()))
+    else:
+        i = 0
+        while len(names) < count and i < len(rows):
+            name,sequence = split_name(rows[i])
+            parts = [sequence]
+            length = len(sequence)
+            i += 1
+            while length < sites and i < len(rows):
+                parts.append(''.join(rows[i].split()))
+                length += len(parts[-1])
+                i += 1
+            names.append(name)
+            sequences.append(parts)
+    for i in range(0,len(names)):
+        yield (names[i],''.join(sequences[i]))
+
+#format registry, every file type has a sniffer (confidence for the begining of the file) and a streaming parser (lines to (ID, sequence) records)
+#new formats only need an entry here, the order breaks ties between formats with the same confidence
+FORMATS = {
+    'fastq':(sniff_fastq,parse_fastq),
+    'sam':(sniff_sam,parse_sam),
+    'mega':(sniff_mega,parse_mega),
+    'embl':(sniff_embl,parse_embl),
+    'genebank':(sniff_genebank,parse_genebank),
+    'vcf':(sniff_vcf,parse_vcf),
+    'fasta':(sniff_fasta,parse_fasta),
+    'gff3':(sniff_gff3,parse_gff3),
+    'phylip':(sniff_phylip,parse_phylip)
+}
+
+#helper function to read the first count records of a record iterator, returns the list of those records and an iterator over all records
+def sample_records(records,count):
+    sample = list(itertools.islice(records,count))
+    return (sample,itertools.chain(sample,records))
+
+#scans the sequences (values of the dictionary or a sample of the records in streaming mode) to detect if it is an amino acid or nucleotided sequence
+def get_seq_type(sequences):
+    for i in sequences:
         if re.match(r'^.*[^ACGTNacgtn]+.*$',i): 
             return 'P' #return 'P' if any other character besides ACGTNactn is found in the sequence
     return 'N' #else return 'N'
 
-#helper function to generate the fasta file with the correct format
-def generate_fasta_string(seq_dict,seq_type):
+#helper function to fold a sequence into lines of fold characters by slicing
+def fold_sequence(sequence,fold):
+    return '\n'.join([sequence[i:i+fold] for i in range(0,len(sequence),fold)])
+
+#helper function to generate the fasta file with the correct format, records is any iterable of (sequence ID, sequence) tuples and each record is
+#written as soon as it is read. The folded records are collected in a buffer that is written once it reaches WRITE_BUFFER bytes, with compress the
+#buffer goes through a gzip or BGZF writer that compresses on a pool of threads. With index the .fai index (and .gzi index for BGZF) is written too
+#The output is named after the input path unless file_name is given, returns the name of the output file
+def generate_fasta_string(records,seq_type,path,fold=70,compress=None,threads=None,index=False,file_name=None):
 
     #generates the fasta file name, if sequence type is amino acid it adds the .faa extension else it addes the .fna extension
-    file_name = re.sub(r'(.*[^\.]+)(\..*)$',r'\1',args.i)
-    if seq_type == 'P':
-        file_name+='.faa'
+    if file_name == None:
+        file_name = re.sub(r'(.*[^\.]+)(\..*)$',r'\1',COMPRESSION_PATTERN.sub('',path)) #reads.fastq.gz is named like reads.fastq
+        if seq_type == 'P':
+            file_name+='.faa'
+        else:
+            file_name+='.fna'
+        if compress != None:
+            file_name+='.gz'
+    if os.path.exists(file_name) and os.path.samefile(file_name,path):
+        raise ValueError('The output file '+file_name+' would overwrite the input file')
+
+    out = open(file_name,'wb') #creates output file based on the correctly generated file name
+    if compress != None:
+        out = bgzf.BlockWriter(out,compress,threads)
+    entries = [] #.fai entries (name, length, offset, line bases, line width)
+    buffer = []
+    size = 0 #number of bytes in the buffer
+    offset = 0 #number of bytes written before the buffer
+    #loop scans for all records
+    for i,sequence in records:
+        head = ('>'+i+'\n').encode() #header with the sequence name
+        seq = (fold_sequence(sequence,fold).upper()+'\n').encode() #sequence folded and in uppercase
+        if index:
+            line_bases = min(fold,len(sequence))
+            entries.append((i.split()[0] if len(i.split()) > 0 else '',len(sequence),offset+size+len(head),line_bases,line_bases+1 if line_bases > 0 else 0))
+        buffer.append(head)
+        buffer.append(seq)
+        size += len(head)+len(seq)
+        if size >= WRITE_BUFFER:
+            out.write(b''.join(buffer))
+            offset += size
+            buffer = []
+            size = 0
+    out.write(b''.join(buffer))
+    out.close()
+
+    if index:
+        fai_file = open(file_name+'.fai','w')
+        for i in entries:
+            fai_file.write('\t'.join(str(j) for j in i)+'\n')
+        fai_file.close()
+        if compress == 'bgzf':
+            out.write_gzi(file_name+'.gzi')
+    return file_name
+
+#converts one input file to fasta, the file type is detected from its content and the output is written by generate_fasta_string
+#streaming mode only keeps one record (and the records used to detect the sequence type) in memory. Returns the name of the output file
+def convert_file(path,fold=70,stream=False,compress=None,threads=None,index=False,file_name=None,bam_options=None):
+    #BAM files are binary so they are checked before the text sniffers and decoded from the decompressed BGZF blocks
+    if is_bam(path,threads):
+        file = bgzf.open_binary(path,threads)
+        try:
+            records = parse_bam(file,**(bam_options or {}))
+            if stream:
+                sample,records = sample_records(records,SAMPLE_RECORDS)
+                t = get_seq_type(i[1] for i in sample)
+            else:
+                seq_list = dict(records) #repeated read names keep the last sequence like parse_content does for sam
+                records = seq_list.items()
+                t = get_seq_type(seq_list.values())
+            return generate_fasta_string(records,t,path,fold,compress,threads,index,file_name)
+        finally:
+            file.close()
+
+    file = bgzf.open_input(path,threads,READ_BUFFER) #gzip and BGZF input is decompressed while it is read
+    try:
+        if stream:
+            content = file.read(DETECT_BYTES)
+            file_type = detect_file_type(content) #detects file type based on the begining of the file
+            content += file.readline() #completes the last line, compressed input can not seek back to the begining
+            records = FORMATS[file_type][1](read_lines(itertools.chain(io.StringIO(content),file))) if file_type != None else iter([])
+            sample,records = sample_records(records,SAMPLE_RECORDS)
+            t = get_seq_type(i[1] for i in sample) #gets the sequence type from the first records
+            return generate_fasta_string(records,t,path,fold,compress,threads,index,file_name) #writes the records as they are parsed
+
+        content = file.read() #reads file contents stores them to content
+        file_type = detect_file_type(content) #detects file type based on content
+        content = content.split('\n') #split content into list based on the new line characters
+        seq_list = parse_content(content,file_type) #properly parse content as a list and file type to extract the sequences and their names
+        t = get_seq_type(seq_list.values()) #gest the sequence type (amino acid, nucleotide)
+        return generate_fasta_string(seq_list.items(),t,path,fold,compress,threads,index,file_name) #generates the fasta file based on sequence type and dictionary with sequences and their names
+    finally:
+        file.close() #closes input file
+
+#converts one file in a worker process, errors are returned with the path so one bad file does not stop the batch
+def convert_task(task):
+    path,options = task
+    try:
+        return (path,convert_file(path,**options),None)
+    except Exception as error:
+        return (path,None,type(error).__name__+': '+str(error))
+
+#helper function to expand the input arguments into a list of files: directories give the files they contain (hidden files and .fai/.gzi indexes
+#are skipped), patterns are expanded with glob (for shells that do not expand them) and every other argument is used as it is
+def get_input_paths(inputs):
+    paths = []
+    for i in inputs:
+        if os.path.isdir(i):
+            for j in sorted(os.listdir(i)):
+                if not j.startswith('.') and not j.endswith(('.fai','.gzi')) and os.path.isfile(os.path.join(i,j)):
+                    paths.append(os.path.join(i,j))
+        elif glob.has_magic(i):
+            paths += sorted(glob.glob(i))
+        else:
+            paths.append(i)
+    return list(dict.fromkeys(paths)) #removes paths given twice and keeps the order
+
+#helper function to concatenate the uncompressed fasta parts of every file (in input order) into the merged output, the .fai entries of each part are
+#moved by the number of bytes written before it. The parts and their indexes are removed
+def merge_outputs(parts,output,compress=None,threads=None,index=False):
+    out = open(output,'wb')
+    if compress != None:
+        out = bgzf.BlockWriter(out,compress,threads)
+    fai_file = open(output+'.fai','w') if index else None
+    offset = 0
+    for part in parts:
+        part_file = open(part,'rb')
+        while True:
+            chunk = part_file.read(WRITE_BUFFER)
+            if len(chunk) == 0:
+                break
+            out.write(chunk)
+        part_file.close()
+        if index:
+            part_fai = open(part+'.fai','r')
+            for line in part_fai:
+                fields = line.rstrip('\n').split('\t')
+                fields[2] = str(int(fields[2])+offset)
+                fai_file.write('\t'.join(fields)+'\n')
+            part_fai.close()
+            os.remove(part+'.fai')
+        offset += os.path.getsize(part)
+        os.remove(part)
+    out.close()
+    if index:
+        fai_file.close()
+        if compress == 'bgzf':
+            out.write_gzi(output+'.gzi')
+
+#converts every input file on a pool of worker processes and reports failed files on stderr without stopping the others. With merge every file is
+#converted to a temporary part next to the merged output and the parts are concatenated in input order. Returns the number of failed files
+def convert_files(paths,options,workers=None,merge=None):
+    tasks = []
+    parts = []
+    for path in paths:
+        task_options = dict(options)
+        if merge != None:
+            descriptor,part = tempfile.mkstemp(prefix='.all2fasta_',suffix='.fna',dir=os.path.dirname(os.path.abspath(merge)))
+            os.close(descriptor)
+            parts.append(part)
+            task_options.update(compress=None,file_name=part)
+        tasks.append((path,task_options))
+
+    failed = set()
+    if len(tasks) == 1 or workers == 1:
+        results = map(convert_task,tasks) #no process pool for a single file
+        executor = None
     else:
-        file_name+='.fna'
-
-    out = open(file_name,'w') #creates output file based on the correctly generated file name
-    #loop scans for all sequences in the dictionary        
-    for i in seq_dict.keys():
-        head = '>'+i+'\n' #string will store the header file with the sequence name
-        seq = '' #will store respective sequence correctly folded
-        k = 0 #keeps track of the fold
-
-        #scans each character in sequence
-        for j in seq_dict[i]:
-            #if character count is larger than the provided fold number then add a new line and reset k to 0
-            if k >= args.f:
-                k = 0
-                seq += '\n'
-            seq+=j
-            k+=1
-        seq = seq.upper() #make sure every character in  sequence is uppercase
-        out.write(head+seq+'\n') #write the header with the sequence to the file
-
-valid = [True,True] #keeps track if arguments are valid
-if args.f < 1:
-    #if fold number is invalid
-    print("Invalid fold number, must be larger than 0!")
-    valid[0] = False
-
-#tries to open file if not able to open (does not exists it throws exception)
-try:
-    file = open(args.i,'r')
-except IOError as x:
-    print("Could not open file, or file does not exist!")
-    valid[1] = False
-
-arg_check(valid) #passes the valid list if one of them is false terminates program
-      
-content = file.read() #reads file contents stores them to content
-file.close() #closes input file
-file_type = detect_file_type(content) #detects file type based on content
-content = content.split('\n') #split content into list based on the new line characters
-seq_list = parse_content(content,file_type) #properly parse content as a list and file type to extract the sequences and their names
-t = get_seq_type(seq_list) #gest the sequence type (amino acid, nucleotide)
-generate_fasta_string(seq_list,t) #generates the fasta file based on sequence type and dictionary with sequences and their names
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+        results = executor.map(convert_task,tasks)
+    try:
+        for path,file_name,error in results:
+            if error != None:
+                print(path+': '+error,file=sys.stderr)
+                failed.add(path)
+            elif merge == None and len(paths) > 1:
+                print(path+' -> '+file_name,file=sys.stderr)
+    finally:
+        if executor != None:
+            executor.shutdown()
+
+    if merge != None:
+        merge_outputs([parts[i] for i in range(0,len(paths)) if paths[i] not in failed],merge,options['compress'],options['threads'],options['index'])
+        for i in range(0,len(paths)):
+            if paths[i] in failed and os.path.exists(parts[i]):
+                os.remove(parts[i])
+                if os.path.exists(parts[i]+'.fai'):
+                    os.remove(parts[i]+'.fai')
+    return len(failed)
+
+if __name__ == '__main__':
+    #parses the fold and input file arguments
+    parser = argparse.ArgumentParser(description="Convert any sequence relevant file type to fasta format",epilog="VCF input gives the reference sequence and one record per sample. When the genotypes have more than one allele (diploid or more, phased | or unphased /) every sample gives one record per haplotype named sample_1, sample_2, ... with the alleles in the order they are written")
+    parser.add_argument('-f',metavar='--fold',type=int,default=70,help='Enter the fold number (How many nucleotides/amino acids to display per line-Default 70)')
+    parser.add_argument('-i',metavar='--input',type=str,nargs='+',help='Enter the input files, glob patterns or directories to convert to fasta format (each file gets its own output unless -m is used)')
+    parser.add_argument('-c',metavar='--compress',type=str,choices=['gzip','bgzf'],help='Enter the compression of the output file <gzip> multi member gzip or <bgzf> blocked gzip that samtools faidx can index (Default not compressed)')
+    parser.add_argument('-t',metavar='--threads',type=int,default=os.cpu_count(),help='Enter the number of threads used to decompress BGZF input and compress the output (Default number of CPUs)')
+    parser.add_argument('-x','--index',action='store_true',help='Write the .fai index of the output (and the .gzi index for bgzf output) while it is written')
+    parser.add_argument('-s','--stream',action='store_true',help='Streaming mode, records are parsed and written one at a time so memory stays constant for large fastq, sam, embl and genebank files')
+    parser.add_argument('-w',metavar='--workers',type=int,default=os.cpu_count(),help='Enter the number of worker processes converting files in parallel (Default number of CPUs)')
+    parser.add_argument('--include-flags',type=int,default=0,help='Enter the flag bits a BAM read must have to be converted (Default 0)')
+    parser.add_argument('--exclude-flags',type=int,default=0,help='Enter the flag bits a BAM read must not have to be converted (Default 0)')
+    parser.add_argument('--min-mapq',type=int,default=0,help='Enter the lowest mapping quality of the BAM reads that are converted (Default 0)')
+    parser.add_argument('-r','--reverse-complement',action='store_true',help='Reverse complement BAM reads on the reverse strand (flag 16) back to the sequenced strand')
+    parser.add_argument('-m',metavar='--merge',type=str,help='Enter an output file to merge the records of all input files into instead of one output per file')
+
+    args = parser.parse_args()
+
+    valid = [True,True,True] #keeps track if arguments are valid
+    if args.f < 1:
+        #if fold number is invalid
+        print("Invalid fold number, must be larger than 0!")
+        valid[0] = False
+    if args.t < 1 or args.w < 1 or (args.index and args.c == 'gzip'):
+        #the index needs uncompressed or bgzf output since gzip members can not be read from the middle
+        print("Invalid threads, workers or index option, threads and workers must be larger than 0 and the index can only be written for uncompressed or bgzf output!")
+        valid[2] = False
+
+    #checks that every input file exists and can be opened
+    paths = get_input_paths(args.i) if args.i != None else []
+    for i in paths:
+        if not os.access(i,os.R_OK) or os.path.isdir(i):
+            print("Could not open file, or file does not exist!",i)
+            valid[1] = False
+    if len(paths) == 0:
+        print("Could not open file, or file does not exist!")
+        valid[1] = False
+
+    arg_check(valid) #passes the valid list if one of them is false terminates program
+
+    bam_options = {'include_flags':args.include_flags,'exclude_flags':args.exclude_flags,'min_mapq':args.min_mapq,'reverse_complement':args.reverse_complement}
+    options = {'fold':args.f,'stream':args.stream,'compress':args.c,'threads':args.t,'index':args.index,'bam_options':bam_options}
+    failed = convert_files(paths,options,args.w,args.m)
+    if failed > 0:
+        print(str(failed)+' of '+str(len(paths))+' files could not be converted')
+        exit(1)
@@ -0,0 +1,225 @@
+#Description: Compressed input and output shared by the conversion scripts. Input files are checked for the gzip magic bytes (and the BC extra field
+#             of BGZF), BGZF blocks are read by a background thread, inflated on a pool of threads and handed to the reader in order through a bounded
+#             queue, other gzip files go through the gzip module. For output, data is cut into blocks that are compressed on a pool of threads (zlib
+#             releases the GIL while it compresses) and written in order. Blocks are either BGZF blocks (the blocked gzip format of samtools/htslib, at most 65280
+#             bytes each, with the BC extra field holding the block size and an empty end of file block) or plain gzip members of a few MB. Both are
+#             valid multi member gzip files that gzip/zcat can read. The compressed and uncompressed offset of every block can be saved as a .gzi index
+
+import collections
+import concurrent.futures
+import gzip
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+
+#largest number of uncompressed bytes in one BGZF block (same value as htslib so a block never grows above the 64 KB limit)
+BGZF_BLOCK_SIZE = 0xff00
+#number of uncompressed bytes in one plain gzip member
+GZIP_MEMBER_SIZE = 1<<22
+#empty BGZF block that marks the end of a BGZF file
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+#first 2 bytes of every gzip member
+GZIP_MAGIC = b'\x1f\x8b'
+#size of the buffer between the decompressed blocks and the text reader
+READ_BUFFER = 1<<20
+
+#helper function to detect the compression of a file from its first bytes, returns 'bgzf', 'gzip' or None for an uncompressed file
+def get_compression(path):
+    file = open(path,'rb')
+    header = file.read(18)
+    file.close()
+    if header[:2] != GZIP_MAGIC:
+        return None
+    if len(header) == 18 and header[3] & 4 and header[12:14] == b'BC':
+        return 'bgzf' #extra field flag set and the first subfield is the BGZF block size
+    return 'gzip'
+
+#helper function to inflate the raw deflate data of one BGZF block and check it against the CRC32 and size stored at the end of the block
+def inflate_block(deflated,crc,size):
+    data = zlib.decompress(deflated,-15)
+    if len(data) != size or zlib.crc32(data) != crc:
+        raise ValueError('Corrupted BGZF block, the CRC32 or size does not match')
+    return data
+
+#binary reader of a BGZF file. A background thread reads the blocks one after the other and sends them to a pool of threads to be inflated, the
+#futures go through a queue of at most a few blocks per thread so reading stops while the consumer is behind. readinto hands out the blocks in order
+class BGZFReader(io.RawIOBase):
+    def __init__(self, path, threads=None):
+        self.file = open(path,'rb')
+        self.threads = threads if threads != None else (os.cpu_count() or 1)
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self.queue = queue.Queue(4*self.threads)
+        self.current = b''
+        self.position = 0
+        self.finished = False
+        self.stopped = False
+        self.reader = threading.Thread(target=self.read_blocks,daemon=True)
+        self.reader.start()
+
+    #runs on the background thread, every block is parsed from its header (BSIZE in the BC subfield is the total block size - 1)
+    def read_blocks(self):
+        try:
+            while not self.stopped:
+                header = self.file.read(12)
+                if len(header) == 0:
+                    break
+                if len(header) < 12 or header[:2] != GZIP_MAGIC or not header[3] & 4:
+                    raise ValueError('Invalid BGZF block header')
+                extra_length = struct.unpack('<H',header[10:12])[0]
+                extra = self.file.read(extra_length)
+                block_size = None
+                i = 0
+                while i + 4 <= len(extra):
+                    length = struct.unpack('<H',extra[i+2:i+4])[0]
+                    if extra[i:i+2] == b'BC' and length == 2:
+                        block_size = struct.unpack('<H',extra[i+4:i+6])[0] + 1
+                    i += 4 + length
+                if block_size == None:
+                    raise ValueError('Invalid BGZF block, the BC extra subfield is missing')
+                rest = self.file.read(block_size - 12 - extra_length)
+                if len(rest) != block_size - 12 - extra_length:
+                    raise ValueError('Truncated BGZF block')
+                crc,size = struct.unpack('<II',rest[-8:])
+                self.queue.put(self.executor.submit(inflate_block,rest[:-8],crc,size))
+        except Exception as error:
+            failed = concurrent.futures.Future()
+            failed.set_exception(error)
+            self.queue.put(failed) #the error is raised in the reading thread when it gets to this block
+        self.queue.put(None)
+
+    def readable(self):
+        return True
+
+    #copies the next decompressed bytes into b, returns 0 at the end of the file
+    def readinto(self, b):
+        while self.position >= len(self.current):
+            if self.finished:
+                return 0
+            future = self.queue.get()
+            if future == None:
+                self.finished = True
+                return 0
+            self.current = future.result()
+            self.position = 0
+        count = min(len(b),len(self.current) - self.position)
+        b[:count] = self.current[self.position:self.position+count]
+        self.position += count
+        return count
+
+    #stops the background thread (the queue is emptied so it is not blocked) and closes the file
+    def close(self):
+        if not self.closed:
+            self.stopped = True
+            while self.reader.is_alive():
+                try:
+                    self.queue.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+            self.executor.shutdown(cancel_futures=True)
+            self.file.close()
+        super().close()
+
+#opens a binary input file that may be compressed (same detection as open_input)
+def open_binary(path,threads=None,buffering=READ_BUFFER):
+    compression = get_compression(path)
+    if compression == 'bgzf':
+        return io.BufferedReader(BGZFReader(path,threads),buffering)
+    if compression == 'gzip':
+        return io.BufferedReader(gzip.GzipFile(path,'rb'),buffering)
+    return open(path,'rb',buffering=buffering)
+
+#opens a text input file that may be compressed, the compression is detected from the magic bytes and not the extension. BGZF files are inflated
+#on threads threads, other gzip files with the gzip module and uncompressed files are opened as usual
+def open_input(path,threads=None,buffering=READ_BUFFER):
+    compression = get_compression(path)
+    if compression == 'bgzf':
+        return io.TextIOWrapper(io.BufferedReader(BGZFReader(path,threads),buffering))
+    if compression == 'gzip':
+        return io.TextIOWrapper(io.BufferedReader(gzip.GzipFile(path,'rb'),buffering))
+    return open(path,'r',buffering=buffering)
+
+#helper function to compress data into one BGZF block: gzip header with the BC extra subfield (total block size - 1), raw deflate data, CRC32 and size
+def compress_bgzf_block(data,level=6):
+    compressor = zlib.compressobj(level,zlib.DEFLATED,-15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH',0x1f,0x8b,8,4,0,0,0xff,6,ord('B'),ord('C'),2,len(deflated)+25)
+    return header + deflated + struct.pack('<II',zlib.crc32(data),len(data))
+
+#helper function to compress data into one plain gzip member (no file name and a 0 modification time so the output is reproducible)
+def compress_gzip_member(data,level=6):
+    compressor = zlib.compressobj(level,zlib.DEFLATED,-15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2B',0x1f,0x8b,8,0,0,0,0xff)
+    return header + deflated + struct.pack('<II',zlib.crc32(data),len(data))
+
+#file like object that compresses everything written to it. mode is 'bgzf' or 'gzip', threads the number of compression threads (Default number of
+#CPUs). At most a few blocks per thread are waiting to be written so memory stays bounded. The offsets of every block are kept for write_gzi
+class BlockWriter:
+    def __init__(self, file, mode='bgzf', threads=None, level=6):
+        self.file = file
+        self.mode = mode
+        self.block_size = BGZF_BLOCK_SIZE if mode == 'bgzf' else GZIP_MEMBER_SIZE
+        self.compress = compress_bgzf_block if mode == 'bgzf' else compress_gzip_member
+        self.level = level
+        self.threads = threads if threads != None else (os.cpu_count() or 1)
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self.pending = collections.deque() #futures of the blocks being compressed in the order they are written
+        self.buffer = bytearray()
+        self.compressed_offset = 0
+        self.uncompressed_offset = 0
+        self.blocks = [] #(compressed offset, uncompressed offset) of every block
+
+    #adds data to the current block, full blocks are sent to the thread pool
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.block_size:
+            view = memoryview(self.buffer)
+            full = len(self.buffer) - len(self.buffer) % self.block_size
+            for i in range(0,full,self.block_size):
+                self.submit(bytes(view[i:i+self.block_size]))
+            view.release()
+            del self.buffer[:full]
+
+    #helper function to compress one block on the thread pool, the oldest blocks are written while too many are waiting
+    def submit(self, data):
+        self.blocks.append((None,self.uncompressed_offset))
+        self.uncompressed_offset += len(data)
+        self.pending.append(self.executor.submit(self.compress,data,self.level))
+        while len(self.pending) > 4*self.threads:
+            self.write_next()
+
+    #helper function to write the oldest compressed block and save its compressed offset
+    def write_next(self):
+        block = self.pending.popleft().result()
+        index = len(self.blocks) - len(self.pending) - 1
+        self.blocks[index] = (self.compressed_offset,self.blocks[index][1])
+        self.file.write(block)
+        self.compressed_offset += len(block)
+
+    #returns the number of uncompressed bytes written so far
+    def tell(self):
+        return self.uncompressed_offset + len(self.buffer)
+
+    #compresses the last block, writes every waiting block and the BGZF end of file block, the underlying file is closed as well
+    def close(self):
+        if len(self.buffer) > 0 or (self.mode == 'gzip' and len(self.blocks) == 0): #an empty gzip file still needs one member
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self.write_next()
+        if self.mode == 'bgzf':
+            self.file.write(BGZF_EOF)
+        self.executor.shutdown()
+        self.file.close()
+
+    #writes the .gzi index of the blocks (number of blocks after the first one, then the compressed and uncompressed offset of each of them as
+    #little endian 64 bit integers, same layout as bgzip -i)
+    def write_gzi(self, path):
+        gzi_file = open(path,'wb')
+        gzi_file.write(struct.pack('<Q',max(0,len(self.blocks)-1)))
+        for compressed,uncompressed in self.blocks[1:]:
+            gzi_file.write(struct.pack('<QQ',compressed,uncompressed))
+        gzi_file.close()
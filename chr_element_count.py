@@ -1,74 +1,304 @@
-#!/usr/bin/env python3 
+#!/usr/bin/env python3
 import argparse
+import array
+import concurrent.futures
+import heapq
+import io
+import mmap
+import os
 import re
+import shutil
+import sys
+import tempfile
+import numpy as np
+import coverage_track
 
-#Description: This program counts the number of occurences of each chromosme region in a BED file. 
+#Description: This program counts the number of occurences of each chromosme region in a BED file.
 #             Ex: [chr1 10 15] and [chr1 12 17], the follwing regions result (chr1 10,12->1 time, chr1 12 15->2 times, chr1 15 17->1 time)
+#             The start and end positions of each chromosome are loaded into int64 arrays and the coverage is computed with a vectorized sweep line
+#             (one stable sort of all the positions, a cumulative sum of the +1/-1 events and boolean masks to select the regions)
+#             Coordinate sorted files can be streamed instead (-s): only a min-heap of the ends of the open intervals is kept and every region is written
+#             as soon as it is final, so memory depends on the largest coverage and not on the file size. Unsorted files can be streamed as well (-u),
+#             they are first cut into sorted spill files on disk which are merged while the coverage is computed. With -w the chromosomes are counted
+#             in parallel on a pool of worker processes, each one reads only the byte ranges of its chromosome. The coverage can also be saved as an
+#             indexed binary track (-b) that coverage_track.py queries without rescanning the text
 
-#parses the input file argument
-parser = argparse.ArgumentParser(description="Counts the occurences each chromosome region is referenced in the BED file")
-parser.add_argument('-i',metavar='--input',type=str,help='Enter the input BED file')
-
-args = parser.parse_args()
-
-#helper function to help determine the number of occurences in each chromosome region
-def parse_occurences(content):
-    chr_pos = {} #dictionary will stores each chromomsome along with a list of checkpoints to scan through
-    #loop scans through the file content
-    for i in content:
-        #if chromosome is not in dictionary add it as key and an empty list as value
-        if i[0] not in chr_pos:
-            chr_pos[i[0]] = []
-        #appends the starting and ending points it reades for each chromosome to respective list in dictionary
-        #from bed file as a list of 2 elemens [Position number,S=Start/E=End label]
-        chr_pos[i[0]].append([int(i[1]),'S'])
-        chr_pos[i[0]].append([int(i[2]),'E'])
-    
-    #scans each chromosome key in dictionary and sorts elements of the list it conatins based on the first value of the sublist (Positon number)
-    for i in chr_pos.keys():
-        chr_pos[i].sort()
-
-    occurence_list = [] #stores sublists in this format [chromosome Number, start postion, end position, coverage] it is a 2D list
-    occurence = 0
-    for i in chr_pos.keys():
-        l = [] #temporary 2D helper list to scan for each region with a specific occurence for each chromosome, resets when scanning different chromosome
-        for j in chr_pos[i]:
-            #while scanning each crhomomosome
-
-            if j[1] == 'S':
-                occurence += 1 #if position number is a starting position increment occurences by 1
-            elif j[1] == 'E':
-                occurence -= 1 #if position number is an ending position decrement occurences by 1
-            l.append([j[0],occurence]) #add the corresponding position number and occurence to temporary list l
-            #if list l stores 2 points
-            if len(l) >= 2:
-                #add they are neither the same postion and neither occurence in first point is 0
-                if l[0][0] != l[1][0] and l[0][1] != 0:
-                    #add to the occurence list a list with chromosome number, start position, end postion, coverage (occurence) number for that region
-                    occurence_list.append([i,l[0][0],l[1][0],l[0][1]]) 
-                l = [l[1]] #reset l to only hold the second element
-    return occurence_list #returns the list containing the coverage info for all the chromosomes in the bed file 
-
-#tries to open file if not able to open (does not exists it throws exception)           
-try:
-    file = open(args.i,'r')
-except IOError as x:
-    print("Could not open file, or file does not exist!")
-    exit(1)
-
-content = file.readlines() #open bed file and store it to content as list
-file.close() #close file
-
-#remove new line characters from each string in content list and split each element based on tab character
-for i in range(0,len(content)):
-    content[i] = content[i].replace('\n','')
-    content[i] = content[i].split('\t')
-
-
-occurence_list = parse_occurences(content) #scan for coverage and save info to occurence_list
-
-#print occurence list in appropriate format to console
-for i in occurence_list:
-    print(str(i[0])+'\t'+str(i[1])+'\t'+str(i[2])+'\t'+str(i[3]))
-
-exit(0)
\ No newline at end of file
+#number of regions converted to text and written at once
+WRITE_CHUNK = 1<<16
+#number of intervals sorted in memory and written to each spill file by the external sort
+SORT_CHUNK = 1<<22
+#number of intervals read at once from each spill file while they are merged
+MERGE_BLOCK = 1<<14
+
+#helper function to read the start and end positions of a BED file, returns a dictionary with the chromosome names as keys (in the order they first
+#appear in the file) and a tuple of 2 int64 arrays (starts, ends) as values. The positions are collected in compact arrays while the file is read
+def read_intervals(file):
+    positions = {} #chromosome -> (array of starts, array of ends)
+    for line in file:
+        if len(line.strip()) == 0:
+            continue #blank lines (for example at the end of the file) hold no interval
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] not in positions:
+            positions[fields[0]] = (array.array('q'),array.array('q'))
+        starts,ends = positions[fields[0]]
+        starts.append(int(fields[1]))
+        ends.append(int(fields[2]))
+    intervals = {}
+    for i in positions.keys():
+        intervals[i] = (np.frombuffer(positions[i][0],dtype=np.int64),np.frombuffer(positions[i][1],dtype=np.int64))
+    return intervals
+
+#helper function to compute the coverage of one chromosome from its start and end arrays, returns the arrays (region starts, region ends, coverage)
+#The ends are placed before the starts so the stable sort puts an end before a start at the same position (a region ending where another begins
+#is not counted twice). The coverage after every event is the cumulative sum of +1 (start) and -1 (end), every pair of consecutive events at
+#different positions is a region with the coverage after the first event, regions with coverage 0 are left out
+def get_coverage(starts,ends):
+    positions = np.concatenate((ends,starts))
+    events = np.concatenate((np.full(len(ends),-1,dtype=np.int64),np.ones(len(starts),dtype=np.int64)))
+    order = np.argsort(positions,kind='stable')
+    positions = positions[order]
+    depth = np.cumsum(events[order])
+    keep = (positions[:-1] != positions[1:]) & (depth[:-1] != 0)
+    return (positions[:-1][keep],positions[1:][keep],depth[:-1][keep])
+
+#helper function to determine the number of occurences in each chromosome region, returns a list of (chromosome, region starts, region ends, coverage)
+#tuples in the order the chromosomes appear in the bed file. The coverage starts at 0 for every chromosome
+def parse_occurences(intervals):
+    occurence_list = []
+    for i in intervals.keys():
+        starts,ends = intervals[i]
+        occurence_list.append((i,)+get_coverage(starts,ends))
+    return occurence_list
+
+#helper function to write the regions of one chromosome as tab separated lines (chromosome, start, end, coverage), the arrays are converted to text
+#a chunk at a time
+def write_occurences(out,chromosome,starts,ends,depth):
+    for i in range(0,len(starts),WRITE_CHUNK):
+        lines = zip(starts[i:i+WRITE_CHUNK].tolist(),ends[i:i+WRITE_CHUNK].tolist(),depth[i:i+WRITE_CHUNK].tolist())
+        out.write(''.join(chromosome+'\t'+str(j[0])+'\t'+str(j[1])+'\t'+str(j[2])+'\n' for j in lines))
+
+#helper function to read the (chromosome, start, end) tuples of a BED file one line at a time
+def read_records(file):
+    for line in file:
+        if len(line.strip()) == 0:
+            continue
+        fields = line.rstrip('\n').split('\t')
+        yield (fields[0],int(fields[1]),int(fields[2]))
+
+#streaming coverage of records sorted by chromosome and start position, writes the same regions as parse_occurences and write_occurences.
+#The ends of the open intervals are kept in a min-heap, before an interval is added every end up to its start is closed (ends before starts at
+#the same position like the sweep line). A region is written when the next event at a different position is reached. Raises ValueError when
+#the records are not sorted, the regions waiting to be written are dropped so nothing after the error is written
+def stream_coverage(records,out):
+    lines = []
+    done = set() #chromosomes already finished, seeing one of them again means the file is not sorted
+    chromosome = None
+    open_ends = []
+    last = None #position of the last event
+    depth = 0
+    previous_start = None #start of the previous record on the same chromosome
+
+    #helper function to move the sweep line to position, the region since the last event is written when it is not empty and covered
+    def add_event(position,change):
+        nonlocal last, depth
+        if position != last and depth != 0:
+            lines.append(chromosome+'\t'+str(last)+'\t'+str(position)+'\t'+str(depth)+'\n')
+        last = position
+        depth += change
+
+    for name,start,end in records:
+        if name != chromosome:
+            while len(open_ends) > 0: #closes the intervals left on the previous chromosome
+                add_event(heapq.heappop(open_ends),-1)
+            if name in done:
+                raise ValueError('The BED file is not sorted, chromosome '+name+' appears again after other chromosomes')
+            done.add(name)
+            chromosome = name
+            last = None
+        elif start < previous_start:
+            raise ValueError('The BED file is not sorted, '+name+' '+str(start)+' comes after '+str(previous_start))
+        if end < start:
+            raise ValueError('Invalid interval, the end is before the start: '+name+' '+str(start)+' '+str(end))
+        previous_start = start
+        while len(open_ends) > 0 and open_ends[0] <= start:
+            add_event(heapq.heappop(open_ends),-1)
+        add_event(start,1)
+        heapq.heappush(open_ends,end)
+        if len(lines) >= WRITE_CHUNK:
+            out.write(''.join(lines))
+            lines.clear()
+    while len(open_ends) > 0:
+        add_event(heapq.heappop(open_ends),-1)
+    out.write(''.join(lines))
+
+#helper function to sort one chunk of (chromosome number, start, end) rows and write it to a new spill file in directory as raw int64 values
+def write_spill(rows,directory):
+    rows = np.frombuffer(rows,dtype=np.int64).reshape(-1,3)
+    rows = rows[np.lexsort((rows[:,1],rows[:,0]))]
+    spill_file = tempfile.NamedTemporaryFile(dir=directory,suffix='.spill',delete=False)
+    rows.tofile(spill_file)
+    spill_file.close()
+    return spill_file.name
+
+#helper function to read the (chromosome number, start, end) rows of a spill file back a block at a time
+def read_spill(path):
+    spill_file = open(path,'rb')
+    while True:
+        rows = np.fromfile(spill_file,dtype=np.int64,count=3*MERGE_BLOCK)
+        if len(rows) == 0:
+            break
+        for i,start,end in rows.reshape(-1,3).tolist():
+            yield (i,start,end)
+    spill_file.close()
+
+#external merge sort of BED records, yields the (chromosome, start, end) tuples sorted by chromosome and start. Chunks of chunk records are sorted
+#in memory and spilled to temporary files that are merged with a heap. Chromosomes are numbered in the order they first appear so the output keeps
+#the chromosome order of the default mode
+def external_sort(records,chunk=SORT_CHUNK,directory=None):
+    directory = tempfile.mkdtemp(prefix='chr_element_count_',dir=directory)
+    try:
+        numbers = {}
+        names = []
+        paths = []
+        rows = array.array('q')
+        for name,start,end in records:
+            if name not in numbers:
+                numbers[name] = len(names)
+                names.append(name)
+            rows.extend((numbers[name],start,end))
+            if len(rows) >= 3*chunk:
+                paths.append(write_spill(rows,directory))
+                rows = array.array('q')
+        if len(rows) > 0:
+            paths.append(write_spill(rows,directory))
+        del rows
+        for i,start,end in heapq.merge(*[read_spill(j) for j in paths]):
+            yield (names[i],start,end)
+    finally:
+        shutil.rmtree(directory,ignore_errors=True)
+
+#helper function to find the byte ranges of every chromosome of a BED file in one pass, returns a dictionary with the chromosome names as keys (in the
+#order they first appear) and a list of (begin, end) byte ranges as values. The file is memory mapped and the end of each run of lines of the same
+#chromosome is found with a regular expression (first line not starting with the name and a tab), so the lines are not split in Python. A sorted
+#file has one range per chromosome, chromosomes spread over the file get several
+def partition_chromosomes(path):
+    file = open(path,'rb')
+    size = os.fstat(file.fileno()).st_size
+    partitions = {}
+    if size == 0:
+        file.close()
+        return partitions
+    data = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+    patterns = {} #chromosome -> compiled pattern of the first line of another chromosome
+    position = 0
+    while position < size:
+        line_end = data.find(b'\n',position)
+        line_end = size if line_end == -1 else line_end
+        if len(data[position:line_end].strip()) == 0:
+            position = line_end+1 #blank lines are skipped like read_intervals does
+            continue
+        tab = data.find(b'\t',position,line_end)
+        name = data[position:tab if tab != -1 else line_end]
+        if name not in patterns:
+            patterns[name] = re.compile(b'^(?!'+re.escape(name)+b'\t)',re.M)
+        match = patterns[name].search(data,line_end)
+        end = size if match == None else min(size,max(line_end+1,match.start())) #the range holds at least the current line
+        partitions.setdefault(name.decode('utf-8'),[]).append((position,end))
+        position = end
+    data.close()
+    file.close()
+    return partitions
+
+#runs in a worker process, reads the byte ranges of one chromosome and returns its regions as the text write_occurences writes
+def count_chromosome(path,ranges):
+    file = open(path,'rb')
+    lines = io.StringIO()
+    for begin,end in ranges:
+        file.seek(begin)
+        lines.write(file.read(end-begin).decode('utf-8'))
+    file.close()
+    lines.seek(0)
+    out = io.StringIO()
+    for i in parse_occurences(read_intervals(lines)):
+        write_occurences(out,*i)
+    return out.getvalue()
+
+#counts every chromosome of a BED file in parallel on workers processes (Default number of CPUs) and writes the regions in the order the chromosomes
+#first appear in the file, same output as the serial mode. The largest chromosomes are sent to the workers first so the pool stays busy until the end
+def parallel_coverage(path,out,workers=None):
+    partitions = partition_chromosomes(path)
+    order = sorted(partitions.keys(),key=lambda i: -sum(j[1]-j[0] for j in partitions[i]))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = {}
+        for i in order:
+            futures[i] = executor.submit(count_chromosome,path,partitions[i])
+        for i in partitions.keys():
+            out.write(futures[i].result())
+            del futures[i] #the text of a chromosome is released once it is written
+
+if __name__ == '__main__':
+    #parses the input file argument
+    parser = argparse.ArgumentParser(description="Counts the occurences each chromosome region is referenced in the BED file")
+    parser.add_argument('-i',metavar='--input',type=str,help='Enter the input BED file')
+    parser.add_argument('-s','--stream',action='store_true',help='Stream a BED file sorted by chromosome and start position with bounded memory')
+    parser.add_argument('-u','--unsorted',action='store_true',help='Stream an unsorted BED file, it is sorted on disk first with an external merge sort')
+    parser.add_argument('-c',metavar='--chunk',type=int,default=SORT_CHUNK,help='Enter the number of intervals sorted in memory for each spill file with -u (Default 4194304)')
+    parser.add_argument('-w',metavar='--workers',type=int,help='Enter the number of worker processes to count the chromosomes in parallel (Default serial)')
+    parser.add_argument('-b',metavar='--binary',type=str,help='Enter the binary coverage track file to write instead of printing the regions (see coverage_track.py)')
+    parser.add_argument('-d',metavar='--tmpdir',type=str,help='Enter the directory of the spill files with -u (Default system temporary directory)')
+
+    args = parser.parse_args()
+
+    #tries to open file if not able to open (does not exists it throws exception)
+    try:
+        file = open(args.i,'r')
+    except IOError as x:
+        print("Could not open file, or file does not exist!")
+        exit(1)
+
+    if args.c < 1 or (args.w != None and args.w < 1):
+        print('The chunk size and number of workers must be positive!')
+        exit(1)
+    if (args.w != None or args.b != None) and (args.stream or args.unsorted):
+        print('Parallel mode (-w) and binary output (-b) can not be combined with the streaming modes (-s, -u)!')
+        exit(1)
+    if args.w != None and args.b != None:
+        print('Binary output (-b) can not be combined with parallel mode (-w)!')
+        exit(1)
+
+    #parallel mode, every worker reads the lines of its chromosomes from the file
+    if args.w != None:
+        file.close()
+        parallel_coverage(args.i,sys.stdout,args.w)
+        exit(0)
+
+    #streaming modes, the regions are written while the file is read
+    if args.stream or args.unsorted:
+        records = read_records(file)
+        if args.unsorted:
+            records = external_sort(records,args.c,args.d)
+        try:
+            stream_coverage(records,sys.stdout)
+        except ValueError as error:
+            print(error,file=sys.stderr) #the regions already written are incomplete, the error goes to stderr so it is not mistaken for output
+            exit(1)
+        finally:
+            records.close() #removes the spill files
+            file.close()
+        exit(0)
+
+    intervals = read_intervals(file) #load the start and end positions of each chromosome
+    file.close() #close file
+
+    occurence_list = parse_occurences(intervals) #scan for coverage and save info to occurence_list
+
+    #save the regions as a binary coverage track instead of printing them
+    if args.b != None:
+        coverage_track.write_track(args.b,occurence_list)
+        exit(0)
+
+    #print occurence list in appropriate format to console
+    for i in occurence_list:
+        write_occurences(sys.stdout,*i)
+
+    exit(0)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+#Description: Binary coverage track written by chr_element_count.py (-b) and queried without loading the file. For every chromosome the coverage is
+#             stored as runs (int64 run starts and int32 depths, the first run starts at 0 and regions without coverage are runs of depth 0), the prefix
+#             sums of depth * length for range means, a block index (the start of every BLOCK_SIZE-th run) and a sparse table of the block maxima for
+#             range maxima, plus zoom levels with the mean and max depth of fixed size bins. All arrays are little endian and 8 byte aligned so the
+#             memory mapped file is read with zero copy NumPy views, a query only touches the pages of the blocks it searches. A directory at the end of
+#             the file holds the name, size and array offsets of every chromosome
+
+import argparse
+import mmap
+import os
+import struct
+import numpy as np
+import fasta_index
+
+#first bytes of a coverage track file
+TRACK_MAGIC = b'COVTRACK'
+#version of the layout below, stored after the magic bytes
+TRACK_VERSION = 1
+#header: magic, version, block size, directory offset
+TRACK_HEADER = struct.Struct('<8sIIQ')
+#directory entry of a chromosome after its name: run count, end of the last run, offsets of the starts, depths, prefix sums, block starts and block
+#maxima sparse table, number of sparse table levels and number of zoom levels
+CHROMOSOME_ENTRY = struct.Struct('<QQQQQQQII')
+#directory entry of a zoom level: bin size, bin count, offsets of the means and maxima
+ZOOM_ENTRY = struct.Struct('<QQQQ')
+#number of runs in each block of the block index
+BLOCK_SIZE = 256
+#bin sizes of the zoom levels in bases
+ZOOM_LEVELS = (1000,10000,100000,1000000)
+
+#helper function to turn the regions of one chromosome from chr_element_count (sorted, not overlapping, may have gaps) into runs that start at 0 and
+#cover every base up to the end of the last region. Gaps become runs of depth 0 and neighbouring runs with the same depth are merged
+#returns (run starts, depths, end)
+def regions_to_runs(starts,ends,depth):
+    if len(starts) == 0:
+        return (np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int32),0)
+    gaps = ends[:-1] != starts[1:]
+    positions = np.concatenate(([0],starts,ends[:-1][gaps]))
+    values = np.concatenate(([0],depth,np.zeros(np.count_nonzero(gaps),dtype=np.int64)))
+    order = np.argsort(positions,kind='stable')
+    positions = positions[order]
+    values = values[order]
+    keep = np.ones(len(positions),dtype=bool)
+    keep[:-1] = positions[:-1] != positions[1:] #a region starting at 0 replaces the run of depth 0 placed there
+    positions = positions[keep]
+    values = values[keep]
+    keep = np.ones(len(positions),dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return (positions[keep].astype(np.int64),values[keep].astype(np.int32),int(ends[-1]))
+
+#helper function to build the sparse table of the block maxima, row k holds the maximum of the 2^k blocks starting at each block
+def build_sparse_table(block_max):
+    table = [block_max]
+    width = 1
+    while 2*width <= len(block_max):
+        previous = table[-1]
+        row = np.full(len(block_max),np.iinfo(np.int32).min,dtype=np.int32)
+        row[:len(block_max)-2*width+1] = np.maximum(previous[:len(block_max)-2*width+1],previous[width:len(block_max)-width+1])
+        table.append(row)
+        width *= 2
+    return np.vstack(table) if len(block_max) > 0 else np.zeros((0,0),dtype=np.int32)
+
+#helper function to get the sum of depth * length of every base before each position, prefix holds the sum before every run start
+def get_prefix_sums(run_starts,depths,prefix,positions):
+    index = np.searchsorted(run_starts,positions,side='right')-1
+    index = np.maximum(index,0)
+    return prefix[index] + depths[index].astype(np.int64)*(positions-run_starts[index])
+
+#helper function to compute the zoom bins of one chromosome, returns (means, maxima) of the bins of bin_size bases covering 0 to end
+#the last bin only covers the bases up to end
+def get_zoom_bins(run_starts,depths,prefix,end,bin_size):
+    bin_starts = np.arange(0,end,bin_size,dtype=np.int64)
+    bin_ends = np.minimum(bin_starts+bin_size,end)
+    sums = get_prefix_sums(run_starts,depths,prefix,bin_ends) - get_prefix_sums(run_starts,depths,prefix,bin_starts)
+    means = (sums/(bin_ends-bin_starts)).astype(np.float32)
+    first = np.searchsorted(run_starts,bin_starts,side='right')-1 #run holding the first base of each bin
+    last = np.searchsorted(run_starts,bin_ends-1,side='right')-1 #run holding the last base of each bin
+    #reduceat covers the runs from first up to the first run of the next bin (only the first run when both are the same), the last run of a bin is
+    #either that run or the one before
+    maxima = np.maximum(np.maximum.reduceat(depths,first),depths[last])
+    return (means,maxima.astype(np.int32))
+
+#writes the coverage regions from chr_element_count.parse_occurences (a list of (chromosome, region starts, region ends, coverage) tuples) as a
+#binary coverage track
+def write_track(path,occurence_list,zoom_levels=ZOOM_LEVELS,block_size=BLOCK_SIZE):
+    file = open(path,'wb')
+    file.write(TRACK_HEADER.pack(TRACK_MAGIC,TRACK_VERSION,block_size,0))
+
+    #helper function to write an array at the next 8 byte aligned offset and return the offset
+    def write_array(values):
+        padding = -file.tell() % 8
+        file.write(b'\0'*padding)
+        offset = file.tell()
+        file.write(np.ascontiguousarray(values).astype(values.dtype.newbyteorder('<')).tobytes())
+        return offset
+
+    directory = []
+    for name,starts,ends,depth in occurence_list:
+        run_starts,depths,end = regions_to_runs(starts,ends,depth)
+        lengths = np.diff(np.append(run_starts,end))
+        prefix = np.concatenate(([0],np.cumsum(depths.astype(np.int64)*lengths)))
+        block_max = np.maximum.reduceat(depths,np.arange(0,len(depths),block_size)) if len(depths) > 0 else depths
+        table = build_sparse_table(block_max)
+        offsets = [write_array(run_starts),write_array(depths),write_array(prefix),write_array(run_starts[::block_size]),write_array(table)]
+        zooms = []
+        for bin_size in zoom_levels:
+            if end == 0:
+                zooms.append((bin_size,0,0,0))
+                continue
+            means,maxima = get_zoom_bins(run_starts,depths,prefix,end,bin_size)
+            zooms.append((bin_size,len(means),write_array(means),write_array(maxima)))
+        directory.append((name,len(run_starts),end,offsets,table.shape[0],zooms))
+
+    #directory at the end of the file, its offset is written into the header
+    padding = -file.tell() % 8
+    file.write(b'\0'*padding)
+    directory_offset = file.tell()
+    file.write(struct.pack('<I',len(directory)))
+    for name,count,end,offsets,levels,zooms in directory:
+        name = name.encode('utf-8')
+        file.write(struct.pack('<H',len(name))+name)
+        file.write(CHROMOSOME_ENTRY.pack(count,end,*offsets,levels,len(zooms)))
+        for i in zooms:
+            file.write(ZOOM_ENTRY.pack(*i))
+    file.seek(0)
+    file.write(TRACK_HEADER.pack(TRACK_MAGIC,TRACK_VERSION,block_size,directory_offset))
+    file.close()
+
+#memory mapped coverage track, chromosomes are looked up by name and positions are 0 based like BED
+class CoverageTrack:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path,'rb')
+        if os.fstat(self.file.fileno()).st_size < TRACK_HEADER.size:
+            self.file.close()
+            raise ValueError('Invalid coverage track, the file is too short: '+path)
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic,version,self.block_size,directory_offset = TRACK_HEADER.unpack_from(self.data,0)
+        if magic != TRACK_MAGIC or version != TRACK_VERSION:
+            self.close()
+            raise ValueError('Invalid coverage track or unsupported version: '+path)
+        self.records = self.read_directory(directory_offset)
+        self.names = list(self.records.keys())
+
+    #reads the directory, every chromosome gets a dictionary with its arrays as views of the mapping
+    def read_directory(self, offset):
+        records = {}
+        count = struct.unpack_from('<I',self.data,offset)[0]
+        offset += 4
+        for i in range(0,count):
+            length = struct.unpack_from('<H',self.data,offset)[0]
+            name = self.data[offset+2:offset+2+length].decode('utf-8')
+            offset += 2+length
+            runs,end,starts,depths,prefix,blocks,table,levels,zoom_count = CHROMOSOME_ENTRY.unpack_from(self.data,offset)
+            offset += CHROMOSOME_ENTRY.size
+            block_count = (runs+self.block_size-1)//self.block_size
+            record = {'end':end,'runs':runs,
+                      'starts':np.frombuffer(self.data,dtype='<i8',count=runs,offset=starts),
+                      'depths':np.frombuffer(self.data,dtype='<i4',count=runs,offset=depths),
+                      'prefix':np.frombuffer(self.data,dtype='<i8',count=runs+1,offset=prefix),
+                      'blocks':np.frombuffer(self.data,dtype='<i8',count=block_count,offset=blocks),
+                      'table':np.frombuffer(self.data,dtype='<i4',count=levels*block_count,offset=table).reshape(levels,block_count),
+                      'zooms':{}}
+            for j in range(0,zoom_count):
+                bin_size,bins,means,maxima = ZOOM_ENTRY.unpack_from(self.data,offset)
+                offset += ZOOM_ENTRY.size
+                record['zooms'][bin_size] = (np.frombuffer(self.data,dtype='<f4',count=bins,offset=means),
+                                             np.frombuffer(self.data,dtype='<i4',count=bins,offset=maxima))
+            records.setdefault(name,record)
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    #returns the end of the last covered region of a chromosome
+    def get_length(self, name):
+        return self.get_entry(name)['end']
+
+    #helper function to get the directory entry of a chromosome
+    def get_entry(self, name):
+        if name not in self.records:
+            raise KeyError('Chromosome '+name+' not found in '+self.path)
+        return self.records[name]
+
+    #helper function to find the run holding a position (0 <= position < end). The block index is searched first and then the runs of one block
+    def find_run(self, record, position):
+        block = int(np.searchsorted(record['blocks'],position,side='right'))-1
+        begin = block*self.block_size
+        starts = record['starts'][begin:begin+self.block_size]
+        return begin+int(np.searchsorted(starts,position,side='right'))-1
+
+    #returns the coverage of one base
+    def get_depth(self, name, position):
+        record = self.get_entry(name)
+        if position < 0 or position >= record['end']:
+            return 0
+        return int(record['depths'][self.find_run(record,position)])
+
+    #returns the (mean, max) coverage of the bases begin to end (0 based, half open, None means the start or end of the chromosome). Bases after the
+    #last covered region have coverage 0. The mean comes from the prefix sums, the max from the runs at both ends and the sparse table in between
+    def get_summary(self, name, begin=None, end=None):
+        record = self.get_entry(name)
+        begin = 0 if begin == None else max(0,begin)
+        end = record['end'] if end == None else end
+        if end <= begin:
+            raise ValueError('Invalid range, the end must be after the start')
+        stop = min(end,record['end'])
+        if begin >= stop:
+            return (0.0,0)
+        first = self.find_run(record,begin)
+        last = self.find_run(record,stop-1)
+        starts = record['starts']
+        depths = record['depths']
+        total = record['prefix'][last] + int(depths[last])*(stop-int(starts[last]))
+        total -= record['prefix'][first] + int(depths[first])*(begin-int(starts[first]))
+        first_block = first//self.block_size + 1 #blocks fully inside the range
+        last_block = last//self.block_size
+        if last_block <= first_block:
+            maximum = int(depths[first:last+1].max())
+        else:
+            maximum = max(int(depths[first:first_block*self.block_size].max()),int(depths[last_block*self.block_size:last+1].max()))
+            level = (last_block-first_block).bit_length()-1
+            table = record['table']
+            maximum = max(maximum,int(table[level,first_block]),int(table[level,last_block-(1<<level)]))
+        if end > stop:
+            maximum = max(maximum,0)
+        return (int(total)/(end-begin),maximum)
+
+    #returns the zoom bins of a chromosome that overlap begin to end as (bin starts, means, maxima), bin_size must be one of the zoom levels
+    def get_zoom(self, name, bin_size, begin=None, end=None):
+        record = self.get_entry(name)
+        if bin_size not in record['zooms']:
+            raise KeyError('No zoom level with bins of '+str(bin_size)+' bases, the zoom levels are '+', '.join(str(i) for i in record['zooms']))
+        means,maxima = record['zooms'][bin_size]
+        first = 0 if begin == None else max(0,begin)//bin_size
+        last = len(means) if end == None else min(len(means),(end+bin_size-1)//bin_size)
+        return (np.arange(first,max(first,last),dtype=np.int64)*bin_size,means[first:last],maxima[first:last])
+
+    #closes the mapping, while views of the arrays are still alive the mapping stays open until they are released
+    def close(self):
+        try:
+            self.data.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+if __name__ == '__main__':
+    #parses the track file, the region and the zoom level
+    parser = argparse.ArgumentParser(description="Queries the depth of a binary coverage track written by chr_element_count.py -b")
+    parser.add_argument('-i',metavar='--input',type=str,help='Enter the coverage track file')
+    parser.add_argument('-r',metavar='--region',type=str,help='Enter the region (chr7:55000000 for one base, chr7:1000-5000 or chr7 for the mean and max, 1 based like samtools). Without a region the chromosomes are listed')
+    parser.add_argument('-z',metavar='--zoom',type=int,help='Enter the bin size of a zoom level to print the bins of the region instead')
+
+    args = parser.parse_args()
+
+    try:
+        track = CoverageTrack(args.i)
+    except IOError:
+        print("Could not open file, or file does not exist!")
+        exit(1)
+    except ValueError as error:
+        print(error)
+        exit(1)
+
+    try:
+        if args.r == None:
+            #chromosome, end of the last covered region and number of runs
+            for i in track.names:
+                print(i+'\t'+str(track.get_length(i))+'\t'+str(track.records[i]['runs']))
+        else:
+            name,begin,end = fasta_index.parse_region(args.r) if args.r not in track else (args.r,None,None)
+            if args.z != None:
+                #bins of the zoom level: chromosome, bin start, bin end, mean, max (0 based half open like BED)
+                bin_starts,means,maxima = track.get_zoom(name,args.z,begin,end)
+                length = track.get_length(name)
+                for i in range(0,len(bin_starts)):
+                    print(name+'\t'+str(bin_starts[i])+'\t'+str(min(bin_starts[i]+args.z,length))+'\t'+'%.4f' % means[i]+'\t'+str(maxima[i]))
+            elif begin != None and end == None:
+                #one base: chromosome, position (1 based like the region) and coverage
+                print(name+'\t'+str(begin+1)+'\t'+str(track.get_depth(name,begin)))
+            else:
+                #range: chromosome, start, end (0 based half open like BED), mean and max coverage
+                begin = 0 if begin == None else begin
+                end = track.get_length(name) if end == None else end
+                mean,maximum = track.get_summary(name,begin,end)
+                print(name+'\t'+str(begin)+'\t'+str(end)+'\t'+'%.4f' % mean+'\t'+str(maximum))
+    except (KeyError,ValueError) as error:
+        print(error.args[0])
+        exit(1)
+    finally:
+        track.close()
@@ -0,0 +1,188 @@
+#Description: FASTA access layer shared by nw_align.py and sw_align.py. A samtools compatible .fai index (name, length, offset, line bases, line width)
+#             is created next to the fasta file or reused when it is newer than the file. The file is memory mapped, so any record or region
+#             (chr1:1000-5000, 1 based and inclusive like samtools faidx) is read without loading the whole file. Records stored on a single line and
+#             regions that lie within one line are returned as zero copy views of the mapping; regions spanning several lines are gathered with
+#             one NumPy copy that drops the newlines
+
+import mmap
+import os
+import re
+import numpy as np
+
+#region syntax accepted by parse_region: name, name:begin or name:begin-end (commas in the numbers are allowed like samtools)
+REGION_PATTERN = re.compile(r'^(.+?)(?::([0-9,]+)(?:-([0-9,]+))?)?$')
+
+#helper function to split a region string into (name, begin, end) with 0 based half open coordinates, begin and end are None when not given
+def parse_region(region):
+    match = REGION_PATTERN.match(region)
+    if match == None:
+        raise ValueError('Invalid region: '+region)
+    name,begin,end = match.groups()
+    begin = int(begin.replace(',',''))-1 if begin != None else None
+    end = int(end.replace(',','')) if end != None else None
+    if begin != None and begin < 0:
+        raise ValueError('Invalid region, positions start at 1: '+region)
+    return (name,begin,end)
+
+#helper function to build the .fai entries of a memory mapped fasta file, returns a list of [name, length, offset, line bases, line width]
+#every line of a record except the last one must have the same length (same rule as samtools faidx)
+def build_index(data):
+    entries = []
+    entry = None
+    last_line = False #set once a shorter line was seen, only the last line of a record may be shorter
+    position = 0
+    size = len(data)
+    while position < size:
+        newline = data.find(b'\n',position)
+        line_end = size if newline == -1 else newline
+        next_position = line_end+1
+        if data[position:position+1] == b'>':
+            words = data[position+1:line_end].split()
+            entry = [words[0].decode('latin-1') if len(words) > 0 else '',0,next_position,0,0]
+            entries.append(entry)
+            last_line = False
+        elif entry != None:
+            width = next_position-position if newline != -1 else line_end-position+1
+            bases = line_end-position
+            if bases > 0 and data[line_end-1:line_end] == b'\r':
+                bases -= 1
+            if bases > 0:
+                if last_line or (entry[3] != 0 and (bases > entry[3] or width != entry[4] and bases == entry[3])):
+                    raise ValueError('Different line length in sequence '+entry[0]+', the fasta file can not be indexed')
+                if entry[3] == 0:
+                    entry[3] = bases
+                    entry[4] = width
+                elif bases < entry[3]:
+                    last_line = True
+                entry[1] += bases
+            elif entry[1] > 0:
+                last_line = True #empty line, only allowed at the end of a record
+            else:
+                entry[2] = next_position #empty lines before the first bases, the sequence starts after them
+        position = next_position
+    return entries
+
+#memory mapped fasta file with its .fai index, records are looked up by name (the first word of the header)
+class FastaIndex:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path,'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ) if size > 0 else b''
+        try:
+            self.entries = self.load_index()
+        except ValueError:
+            self.close()
+            raise
+        self.names = [i[0] for i in self.entries]
+        self.records = {}
+        for i in self.entries:
+            self.records.setdefault(i[0],i)
+
+    #reads the .fai file if it is newer than the fasta file, otherwise the index is built and written (ignored when the directory is read only)
+    def load_index(self):
+        fai_path = self.path+'.fai'
+        if os.path.exists(fai_path) and os.path.getmtime(fai_path) >= os.path.getmtime(self.path):
+            entries = []
+            fai_file = open(fai_path,'r')
+            for line in fai_file:
+                words = line.rstrip('\n').split('\t')
+                if len(words) >= 5:
+                    entries.append([words[0]]+[int(i) for i in words[1:5]])
+            fai_file.close()
+            return entries
+        entries = build_index(self.data)
+        try:
+            fai_file = open(fai_path,'w')
+            for i in entries:
+                fai_file.write('\t'.join(str(j) for j in i)+'\n')
+            fai_file.close()
+        except OSError:
+            pass
+        return entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    #returns the length of a record
+    def get_length(self, name):
+        return self.get_entry(name)[1]
+
+    #helper function to get the index entry of a record
+    def get_entry(self, name):
+        if name not in self.records:
+            raise KeyError('Sequence '+name+' not found in '+self.path)
+        return self.records[name]
+
+    #returns the bases begin to end (0 based, half open, end None means the end of the record) of a record as a uint8 NumPy array
+    #the array is a view of the mapping when the bases are stored contiguously (single line records or a region within one line), otherwise a copy
+    def fetch_array(self, name, begin=None, end=None):
+        _,length,offset,bases,width = self.get_entry(name)
+        begin = 0 if begin == None else min(begin,length)
+        end = length if end == None else max(begin,min(end,length))
+        if begin == end:
+            return np.zeros(0,dtype=np.uint8)
+        first_line,first_column = divmod(begin,bases)
+        last_line,last_column = divmod(end-1,bases)
+        if first_line == last_line:
+            return np.frombuffer(self.data,dtype=np.uint8,count=end-begin,offset=offset+first_line*width+first_column)
+        #the lines of a record are rows of a 2D view with the line width as stride, the newline columns are cut off and the rows flattened
+        lines = last_line-first_line+1
+        start = offset+first_line*width
+        stop = min(len(self.data),start+lines*width)
+        view = np.frombuffer(self.data,dtype=np.uint8,count=stop-start,offset=start)
+        if len(view) < lines*width:
+            view = np.concatenate((view,np.zeros(lines*width-len(view),dtype=np.uint8))) #last line of the file without newline
+        view = view.reshape(lines,width)[:,:bases].reshape(-1)
+        return view[first_column:first_column+end-begin]
+
+    #same as fetch_array but returns bytes
+    def fetch(self, name, begin=None, end=None):
+        return self.fetch_array(name,begin,end).tobytes()
+
+    #returns the bases of a region string (chr1, chr1:1000 or chr1:1000-5000)
+    def fetch_region(self, region):
+        if region in self.records:
+            return self.fetch_array(region) #names containing ':' are looked up as a whole first like samtools
+        name,begin,end = parse_region(region)
+        return self.fetch_array(name,begin,end)
+
+    #closes the mapping, while views returned by fetch_array are still alive the mapping stays open until they are released
+    def close(self):
+        if isinstance(self.data,mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                pass
+        self.file.close()
+
+#helper function to read a record or region of a fasta file line by line (same region syntax as FastaIndex.fetch_region, the first record by default)
+#used for files that can not be indexed because the lines of a record have different lengths, returns the bases as a string
+def read_unindexed(path,region=None):
+    records = {}
+    names = []
+    lines = None
+    file = open(path,'r')
+    for line in file:
+        if line.startswith('>'):
+            words = line[1:].split()
+            name = words[0] if len(words) > 0 else ''
+            names.append(name)
+            lines = None #only the first record with a name is kept like the index does
+            if name not in records:
+                lines = []
+                records[name] = lines
+        elif lines != None:
+            lines.append(line.strip())
+    file.close()
+    if region == None:
+        return ''.join(records[names[0]]) if len(names) > 0 else ''
+    if region in records:
+        return ''.join(records[region])
+    name,begin,end = parse_region(region)
+    if name not in records:
+        raise KeyError('Sequence '+name+' not found in '+path)
+    return ''.join(records[name])[begin:end]
@@ -3,19 +3,46 @@
 #Description: This program performs the Needleman–Wunsch global sequence alignment for 2 input fasta files and prints out the alignment with an alignment score
 #             This uses a fixed scoring matrix with -1 for mismatch or gap and +1 for match
 
+import argparse
+import functools
+import os
 import sys
+import numpy as np
+from align_traceback import PackedTraceback, NONE, DIAG, UP, LEFT
+import align_batch
+import align_server
+import fasta_index
 
-#helper function to read fasta sequence from file path
-def read_sequence(seq_file_path):
-    seq_file = open(seq_file_path,'r') #opens fasta file in read mode
-    seq_contents = seq_file.readlines() #stores file lines in list
-    seq_file.close() #closes file
-    seq_string = ' ' #adds empty character at beginning (important when we align the 2D grid for alignment)
-
-    #for loop scans all the lines except for the header and concatenates it to the seq_string it while removing any new line characters
-    for i in range(1,len(seq_contents)):
-        seq_contents[i] = str.replace(seq_contents[i],'\n','')
-        seq_string += seq_contents[i]
+#fixed scoring values used by the vectorized engine (same values get_cordinate_value uses)
+MATCH = 1
+MISMATCH = -1
+GAP = -1
+
+#largest number of cells the linear memory mode aligns with a full traceback grid instead of splitting the problem further
+HIRSCHBERG_BLOCK = 1<<16
+
+#smallest band (number of extra diagonals on each side) the automatic banded mode starts with
+BAND_MIN = 16
+#score given to cells outside of the band, low enough that it never wins and never overflows when scores are added
+OUT_OF_BAND = -(1<<40)
+
+#helper function to read fasta sequence from file path, region picks a record or part of one (chr1:1000-5000), the first record is used by default
+#the file is memory mapped through its .fai index so only the requested bases are read, files with lines of different lengths can not be indexed
+#and are read line by line instead
+def read_sequence(seq_file_path,region=None):
+    try:
+        fasta = fasta_index.FastaIndex(seq_file_path)
+    except ValueError:
+        return ' ' + fasta_index.read_unindexed(seq_file_path,region)
+    if region != None:
+        bases = fasta.fetch_region(region)
+    elif len(fasta) > 0:
+        bases = fasta.fetch_array(fasta.names[0])
+    else:
+        bases = b''
+    seq_string = ' ' + bytes(bases).decode('latin-1') #adds empty character at beginning (important when we align the 2D grid for alignment)
+    del bases
+    fasta.close()
     return seq_string #sequence string is returned
 
 #generates a 2D grid whose dimensions is equal to the 2 sequence lengths (contains current score and previous direction (Diagonal,Left,Up))
@@ -79,6 +106,166 @@ def traverse_grid(grid,seq1,seq2):
         y+=1
     return grid
 
+#helper function to convert a sequence string into an array of byte values so whole rows can be compared at once
+def encode_sequence(seq):
+    return np.frombuffer(seq.encode('latin-1'),dtype=np.uint8)
+
+#vectorized version of generate_grid + traverse_grid, the grid is filled one row (wavefront) at a time with integer arrays and only two score rows are kept
+#the left gap dependency inside a row is resolved with a running maximum: H[x] = max(best diagonal/up value at k + GAP*(x-k)) for k <= x
+#ties are broken the same way as get_cordinate_value (Diagonal before Up before Left)
+def fill_grid_numpy(seq1,seq2):
+    s1 = encode_sequence(seq1)
+    cols = len(seq1)
+    grid = PackedTraceback(len(seq2),cols) #2 bits per cell instead of a [score, direction] list
+    offsets = GAP*np.arange(cols,dtype=np.int64) #gap cost of walking left from column 0 to every column
+    row = offsets.copy() #first row only has left gaps
+    codes = np.full(cols,LEFT,dtype=np.uint8)
+    codes[0] = NONE
+    grid.set_row(0,codes)
+
+    #score profile (match or mismatch value against every character of seq1) for each distinct character of seq2, computed once per character
+    profile = {}
+    for c in set(seq2[1:]):
+        profile[c] = np.where(s1[1:] == ord(c),MATCH,MISMATCH)
+
+    t = np.empty(cols,dtype=np.int64)
+    for y in range(1,len(seq2)):
+        diag = row[:-1] + profile[seq2[y]]
+        up = row[1:] + GAP
+        best = np.maximum(diag,up)
+        t[0] = row[0] + GAP #first column only has up gaps
+        t[1:] = best - offsets[1:]
+        acc = np.maximum.accumulate(t) #running maximum takes care of the left gaps of the whole row at once
+        codes[0] = UP
+        #a left gap is only used when it is strictly better than both diagonal and up values
+        codes[1:] = np.where(acc[:-1] > t[1:],LEFT,np.where(diag >= up,DIAG,UP))
+        grid.set_row(y,codes)
+        row = acc + offsets
+    grid.scores[(len(seq2)-1,cols-1)] = int(row[-1])
+    return grid
+
+#helper function to compute only the last row of the grid for seq1 (columns) against seq2 (rows) while keeping just 2 score rows in memory
+#sequences are passed without the leading empty character
+def last_row_scores(seq1,seq2):
+    s1 = encode_sequence(seq1)
+    offsets = GAP*np.arange(len(seq1)+1,dtype=np.int64)
+    row = offsets.copy()
+    profile = {}
+    t = np.empty(len(seq1)+1,dtype=np.int64)
+    for c in seq2:
+        if c not in profile:
+            profile[c] = np.where(s1 == ord(c),MATCH,MISMATCH)
+        t[0] = row[0] + GAP
+        t[1:] = np.maximum(row[:-1] + profile[c],row[1:] + GAP) - offsets[1:]
+        row = np.maximum.accumulate(t) + offsets #same running maximum trick as fill_grid_numpy for the left gaps
+    return row
+
+#banded version of fill_grid_numpy, only the cells whose diagonal (x - y) is at most band diagonals away from the corridor between
+#the main diagonal and the diagonal of the bottom right corner are computed and stored, so time and memory are O(n*band)
+def fill_grid_banded(seq1,seq2,band):
+    s1 = encode_sequence(seq1)
+    cols = len(seq1)
+    diff = (len(seq1)-1) - (len(seq2)-1) #diagonal of the bottom right corner
+    low = min(0,diff) - band #lowest diagonal inside the band
+    high = max(0,diff) + band #highest diagonal inside the band
+    width = min(cols,high - low + 1)
+    grid = PackedTraceback(len(seq2),width,cols,banded=True)
+
+    profile = {}
+    for c in set(seq2[1:]):
+        profile[c] = np.where(s1[1:] == ord(c),MATCH,MISMATCH)
+
+    #first row only has left gaps
+    prev_lo = 0
+    prev_hi = min(cols-1,high)
+    row = GAP*np.arange(prev_hi+1,dtype=np.int64)
+    codes = np.full(prev_hi+1,LEFT,dtype=np.uint8)
+    codes[0] = NONE
+    grid.set_row(0,codes)
+    for y in range(1,len(seq2)):
+        lo = max(0,y + low)
+        hi = min(cols-1,y + high)
+        #previous row widened to the columns lo-1..hi so diagonal and up values can be read by slicing, cells outside of the band get OUT_OF_BAND
+        prev = np.full(hi - lo + 2,OUT_OF_BAND,dtype=np.int64)
+        a = max(prev_lo,lo-1)
+        b = min(prev_hi,hi)
+        if a <= b:
+            prev[a-(lo-1):b-(lo-1)+1] = row[a-prev_lo:b-prev_lo+1]
+        xs = np.arange(lo,hi+1,dtype=np.int64)
+        first = 1 if lo == 0 else 0 #column 0 only has up gaps
+        diag = prev[first:-1] + profile[seq2[y]][lo+first-1:hi]
+        up = prev[first+1:] + GAP
+        t = np.empty(hi - lo + 1,dtype=np.int64)
+        if first:
+            t[0] = GAP*y
+        t[first:] = np.maximum(diag,up) - GAP*xs[first:]
+        acc = np.maximum.accumulate(t)
+        codes = np.empty(hi - lo + 1,dtype=np.uint8)
+        codes[first:] = np.where(diag >= up,DIAG,UP)
+        if first:
+            codes[0] = UP
+        codes[1:] = np.where(acc[:-1] > t[1:],LEFT,codes[1:])
+        grid.set_row(y,codes,lo)
+        row = acc + GAP*xs
+        prev_lo = lo
+        prev_hi = hi
+    grid.scores[(len(seq2)-1,cols-1)] = int(row[-1])
+    return grid
+
+#helper function to check if a banded score is the optimal score. Any path leaving the band needs at least |diff| + 2*(band+1) gaps, so its score
+#is at most MATCH*(n+m-gaps)/2 + GAP*gaps, if the banded score reaches that bound no path outside of the band can do better
+def band_is_optimal(seq1,seq2,band,score):
+    n = len(seq1)-1
+    m = len(seq2)-1
+    if band >= max(n,m):
+        return True #band already covers the whole grid
+    gaps = abs(n-m) + 2*(band+1)
+    return score*2 >= MATCH*(n+m-gaps) + 2*GAP*gaps
+
+#helper function for the banded mode, a fixed band is used as given while the automatic band starts from the length difference of the sequences
+#(BAND_MIN at least) and doubles until the score is provably optimal
+def fill_grid_adaptive(seq1,seq2,band=None):
+    if band != None:
+        return fill_grid_banded(seq1,seq2,band)
+    band = max(BAND_MIN,abs(len(seq1)-len(seq2)))
+    while True:
+        grid = fill_grid_banded(seq1,seq2,band)
+        if band_is_optimal(seq1,seq2,band,grid[len(grid)-1][grid.cols-1][0]):
+            return grid
+        band *= 2
+
+#Hirschberg divide and conquer: seq2 is split in half and the column where an optimal path crosses the middle row is found from the forward scores
+#of the top half and the backward scores of the bottom half, both halves are then aligned recursively. Small sub problems use the full grid.
+#returns the alignment columns in order from the begining of the sequences in the same [seq2 character, notation, seq1 character] format as get_alignment
+def hirschberg(seq1,seq2):
+    if len(seq1)*len(seq2) <= HIRSCHBERG_BLOCK or len(seq2) <= 1:
+        grid = fill_grid_numpy(' '+seq1,' '+seq2)
+        return get_alignment(grid,' '+seq1,' '+seq2)[0][::-1]
+    mid = len(seq2)//2
+    forward = last_row_scores(seq1,seq2[:mid])
+    backward = last_row_scores(seq1[::-1],seq2[mid:][::-1])[::-1]
+    split = int(np.argmax(forward + backward)) #column of seq1 where an optimal alignment crosses the middle row
+    return hirschberg(seq1[:split],seq2[:mid]) + hirschberg(seq1[split:],seq2[mid:])
+
+#helper function to get the alignment and score in linear memory, the score rows always run along the shorter sequence so only O(min(m,n)) scores are kept
+#returns the same (alignment, score) tuple as get_alignment so it can be formatted with format_alignment
+def get_alignment_linear(seq1,seq2):
+    seq1 = seq1[1:] #removes the empty character added by read_sequence
+    seq2 = seq2[1:]
+    if len(seq1) <= len(seq2):
+        columns = hirschberg(seq1,seq2)
+    else:
+        columns = [[i[2],i[1],i[0]] for i in hirschberg(seq2,seq1)] #swap the sequences back into their original places
+    switch = {
+        '|':MATCH,
+        '*':MISMATCH,
+        ' ':GAP
+    }
+    score = 0
+    for i in columns:
+        score += switch.get(i[1])
+    return (columns[::-1],score)
+
 #helper function to traceback the finalized grid and determine the sequence alignment along with the alignment score
 def get_alignment(grid,seq1,seq2):
     #start scanning the cell at the bottom most right corner, score is the value of that cell
@@ -125,17 +312,39 @@ def format_alignment(alignment):
     formated = seq1_format+'\n'+align_notation+'\n'+seq2_format #concatenates the 3 generated strings by separating them with a new line character
     return formated
 
-#reads the sequences from 2 input fasta files from command line
-seq1 = read_sequence(sys.argv[1])
-seq2 = read_sequence(sys.argv[2])
-    
-#initilaize a 2D grid for the 2 sequences and travserse the grid accordingly with the correct score and driection of previous cell   
-grid = generate_grid(seq1, seq2)
-grid = traverse_grid(grid, seq1, seq2)
-align = get_alignment(grid,seq1,seq2) #traceback the grid to get the alignment
-print('Score:',align[1]) #print the alignment score
-print(format_alignment(align)) #print the alignment properly formated
+#helper function used by the batch mode to align one pair of sequences with the engine options of the command line, returns the alignment, the score
+#and the end of the alignment in both sequences
+def align_pair(seq1,seq2,engine='numpy',linear_memory=False,band=None):
+    align = get_global_alignment(seq1,seq2,engine,linear_memory,band)
+    return (align[0],align[1],(len(seq1)-1,len(seq2)-1))
 
+#helper function to fill the grid with the chosen engine (same options as the command line flags, band is None, 'auto' or a number) and traceback
+#the alignment, returns the same (alignment, score) tuple as get_alignment
+def get_global_alignment(seq1,seq2,engine='numpy',linear_memory=False,band=None):
+    if engine not in ('numpy','grid'):
+        raise ValueError('Unknown engine: '+str(engine))
+    if linear_memory:
+        return get_alignment_linear(seq1,seq2) #divide and conquer alignment without the full grid
+    if band == 'auto':
+        grid = fill_grid_adaptive(seq1,seq2)
+    elif band != None:
+        grid = fill_grid_adaptive(seq1,seq2,int(band))
+    elif engine == 'numpy':
+        grid = fill_grid_numpy(seq1,seq2)
+    else:
+        grid = generate_grid(seq1,seq2)
+        grid = traverse_grid(grid,seq1,seq2)
+    return get_alignment(grid,seq1,seq2) #traceback the grid to get the alignment
+
+#importable version of the command line alignment, seq1 and seq2 are plain sequence strings (without the empty character at the begining)
+#returns a dictionary with the score, the aligned sequences with gaps, the notation line, the 1 based begin and end in both sequences and the identity
+def align_global(seq1,seq2,engine='numpy',linear_memory=False,band=None):
+    seq1 = ' ' + seq1
+    seq2 = ' ' + seq2
+    align = get_global_alignment(seq1,seq2,engine,linear_memory,band)
+    return align_batch.alignment_to_dict(align[0],align[1],(len(seq1)-1,len(seq2)-1))
+
+#helper function to print the grid with the sequence characters along its sides (used for debugging)
 def print_grid_space(grid,seq1,seq2):
     h_str = '     '
     for i in seq1:
@@ -146,4 +355,62 @@ def print_grid_space(grid,seq1,seq2):
         print(seq2[j],i)
         j+=1
 
-#print_grid_space(grid, seq1, seq2)
+#command line interface, only runs when the script is executed directly so the helper functions can be imported (and used by worker processes)
+if __name__ == '__main__':
+    #parses the 2 input fasta files and the engine used to fill the grid
+    parser = argparse.ArgumentParser(description="Needleman-Wunsch global alignment of 2 fasta files")
+    parser.add_argument('seq1',type=str,nargs='?',help='Enter the first input fasta file (not used in server mode)')
+    parser.add_argument('seq2',type=str,nargs='?',help='Enter the second input fasta file (optional in batch mode)')
+    parser.add_argument('-e',metavar='--engine',type=str,default='numpy',choices=['numpy','grid'],help='Enter the engine used to fill the grid <numpy> vectorized (Default) or <grid> original nested list grid')
+    parser.add_argument('-l','--linear-memory',action='store_true',help='Use the Hirschberg linear memory mode instead of storing the whole grid (for long sequences)')
+    parser.add_argument('-b','--band',type=str,help='Only compute cells within a diagonal band, <auto> picks the band from the length difference and doubles it until the score is optimal, a number sets a fixed band')
+
+    parser.add_argument('-m','--multi',action='store_true',help='Batch mode, align every pair of records of the first multi fasta file, or every record of the first file against every record of the second one, and write a TSV with the results')
+    parser.add_argument('-p','--pairs',type=str,help='Enter a file with one pair of sequence IDs per line to align only those pairs in batch mode')
+    parser.add_argument('-w','--workers',type=int,default=os.cpu_count(),help='Enter the number of worker processes used in batch mode (Default number of CPUs)')
+    parser.add_argument('-o','--output',type=str,help='Enter the TSV output file for batch mode (Default prints to console)')
+    parser.add_argument('--region1',type=str,help='Enter the record or region of the first fasta file to align, <name> or <name:begin-end> (1 based, inclusive, Default first record)')
+    parser.add_argument('--region2',type=str,help='Enter the record or region of the second fasta file to align, <name> or <name:begin-end> (1 based, inclusive, Default first record)')
+    parser.add_argument('--serve',type=str,metavar='SOCKET',help='Server mode, answer JSON line alignment requests on this Unix socket with a pool of -w worker processes')
+
+    args = parser.parse_args()
+
+    #server mode keeps the workers running and aligns the pairs sent to the socket
+    if args.serve != None:
+        align_server.serve(args.serve,align_global,args.workers)
+        exit(0)
+    if args.seq1 == None:
+        print('The first input fasta file is required unless server mode is used!')
+        exit(1)
+
+    #checks if the band argument is valid
+    if args.band != None and args.band != 'auto' and not (args.band.isdigit()):
+        print('Invalid band, must be <auto> or a positive number!')
+        exit(1)
+
+    #batch mode aligns all pairs of records on a pool of worker processes with the engine options of the command line
+    if args.multi:
+        out = open(args.output,'w') if args.output != None else sys.stdout
+        align_function = functools.partial(align_pair,engine=args.e,linear_memory=args.linear_memory,band=args.band)
+        align_batch.run_batch(align_function,args.seq1,args.seq2,args.pairs,args.workers,out)
+        if out != sys.stdout:
+            out.close()
+        exit(0)
+    if args.seq2 == None:
+        print('The second input fasta file is required unless batch mode is used!')
+        exit(1)
+
+    #reads the sequences from 2 input fasta files from command line
+    try:
+        seq1 = read_sequence(args.seq1,args.region1)
+        seq2 = read_sequence(args.seq2,args.region2)
+    except (KeyError,ValueError) as error:
+        print(error.args[0])
+        exit(1)
+
+    #initilaize a 2D grid for the 2 sequences and travserse the grid accordingly with the correct score and driection of previous cell
+    align = get_global_alignment(seq1, seq2, args.e, args.linear_memory, args.band)
+    print('Score:',align[1]) #print the alignment score
+    print(format_alignment(align)) #print the alignment properly formated
+
+    #print_grid_space(grid, seq1, seq2)
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 #Description: This program uses 2 BED files as input and then tries to find which of the regions overlap by at least a certain percentage threshold set by the user. 
-#             Optimiziations such as the BED files being sorted first are used to speed up the lookup time.
+#             The regions of the second BED file are sorted and indexed per chromosome with an implicit augmented interval tree, so every region of
+#             the first file only visits the regions of the second one that can overlap it.
 
 import argparse
 
@@ -49,62 +50,111 @@ def open_bed(path):
         chr_list[i].sort()
     return chr_list #returns the dictionary with the needed info for each chromosome
 
+#largest level of the interval tree whose nodes are scanned linearly instead of visited one by one (small subtrees are faster to scan)
+SCAN_LEVEL = 3
+
+#helper function to build an implicit augmented interval tree over a list of start-end positions sorted by start (same layout as cgranges). The sorted
+#list itself is an in order binary tree: the nodes of level k are the indices with the k lowest bits set and their children are 2^(k-1) to the left and
+#right. Every node stores the largest end position of its subtree so a query skips the subtrees that end before it begins
+#returns (starts, ends, largest end of every subtree, level of the root)
+def build_index(intervals):
+    starts = [i[0] for i in intervals]
+    ends = [i[1] for i in intervals]
+    max_ends = list(ends)
+    n = len(intervals)
+    if n == 0:
+        return (starts,ends,max_ends,0)
+    last_i = (n-1) & ~1 #last leaf, used as the right child of nodes whose right subtree is past the end of the list
+    last = ends[last_i]
+    k = 1
+    while 1<<k <= n:
+        x = 1<<(k-1)
+        for i in range((x<<1)-1,n,x<<2):
+            right = max_ends[i+x] if i+x < n else last
+            max_ends[i] = max(ends[i],max_ends[i-x],right)
+        last_i = last_i-x if last_i>>k & 1 else last_i+x
+        if last_i < n and max_ends[last_i] > last:
+            last = max_ends[last_i]
+        k += 1
+    return (starts,ends,max_ends,k-1)
+
+#helper function to find every interval of the index overlapping begin-end (at least one shared base), returns their indices in the sorted list in
+#increasing order. Subtrees whose largest end is not after begin are skipped and the right subtree is only visited while its node starts before
+#end, so a query takes O(log n + number of overlaps)
+def query_index(index,begin,end):
+    starts,ends,max_ends,level = index
+    n = len(starts)
+    hits = []
+    if n == 0:
+        return hits
+    stack = [(level,(1<<level)-1,False)] #(level, node, left subtree already visited)
+    while len(stack) > 0:
+        k,x,visited = stack.pop()
+        if k <= SCAN_LEVEL:
+            #small subtree, its positions are scanned in order until a start is past the end
+            i = x >> k << k
+            stop = min(n,i+(1<<(k+1))-1)
+            while i < stop and starts[i] < end:
+                if begin < ends[i]:
+                    hits.append(i)
+                i += 1
+        elif not visited:
+            stack.append((k,x,True))
+            y = x-(1<<(k-1)) #left child
+            if y >= n or max_ends[y] > begin:
+                stack.append((k-1,y,False))
+        elif x < n and starts[x] < end:
+            if begin < ends[x]:
+                hits.append(x)
+            stack.append((k-1,x+(1<<(k-1)),False)) #right child
+    hits.sort()
+    return hits
+
 #helper function that detects overlaps of the first input dictionary from the first bed file when contrasted to the second one that passes a specified matching percentage threshold
 #returns list of overlaped positions
 def detect_overlaps(input1, input2, match):
     out_list = [] #list of overlaped positions
-    
 
     #traverse through each key in dictionary derived from first bed file
     for i in input1.keys():
-        #Each start-end positions in dictionary are sorted (plays big role in optimizing search time). A begin_index variable is used to keep track of the postion of the last match.
-        #since new start-end postion from input1 will have a larger value it will only need to start scanning at the matching postion of input2 for the previous start-end postion
-        #instead at the begining of the input2. Also if start postion of input2 is larger than end position of input1 the search stops since the next start-end postions of input2
-        #will be even larger hence never have an overlap with input1.
+        #chromosomes missing from the second bed file have no overlaps
+        if i not in input2:
+            continue
 
-        begin_index = 0 #begin_index is initialized to 0 when working with new chromosome
+        #the start-end positions of the second bed file are indexed once per chromosome, every start-end pair of input1 then only visits the parts of
+        #the index that can overlap it, long intervals containing shorter ones are found as well
+        index = build_index(input2[i])
 
         #traverse through each start-end pair for each chromosome
         for j in input1[i]:
-            found = False #becomes true if overlap passing matching percentage threshold is found, intially false
-
-            #find overlaps for current start-end position of input1 in input2, start at begin_index since previous start-end postions in input2 are smaller hence no overlap
-            for k in range(begin_index,len(input2[i])):
+            length = j[1] - j[0] #calculate length of chromosome segment from input1
 
-                #if current end position from input1 is larger than start position from input2 then exit loop as no new matches will be found
-                if j[1] < input2[i][k][0]:
-                    #if no overlap has been found for start-end position from input1 update begin_index
-                    if found == False:
-                        begin_index = k
-                    break #exit loop
+            #if length is 0 no overlap will ever be found
+            if length <= 0:
+                continue
 
+            #the overlaps are visited in the sorted order of input2
+            for k in query_index(index,j[0],j[1]):
                 overlap = min(j[1],input2[i][k][1]) - max(j[0],input2[i][k][0]) #caluclate bases overlapping (should be larger than 0 if there is some overlap)
-                length = j[1] - j[0] #calculate length of chromosome segment from input1
 
-                #if length is 0 exit the loop as no overlap will ever be found
-                if length == 0:
-                    break
+                #intervals of input2 without length share no bases
+                if overlap <= 0:
+                    continue
 
                 percentage = (float(overlap)/float(length))*100 #calculate the percentage of segment from input1 overlaping in input2
 
-                #if some overlap exists
-                if overlap > 0:
-                    #if it is first overlap then set found to True and update begin_index
-                    if found == False:
-                        begin_index = k
-                        found = True
-                    #if the percentage passes the matching threshold
-                    if percentage >= match:
-                        #if join flag is present append the the list of overlapped postions the chromosme name, start-end position from input1 and where it overlaps in input2
-                        if args.j:
-                            out_list.append([i,j,input2[i][k]])
+                #if the percentage passes the matching threshold
+                if percentage >= match:
+                    #if join flag is present append the the list of overlapped postions the chromosme name, start-end position from input1 and where it overlaps in input2
+                    if args.j:
+                        out_list.append([i,j,input2[i][k]])
+                    else:
+                        #if join flag is absent check if the current start-end postion for that chromosome already is in list
+                        if len(out_list)>0 and out_list[len(out_list)-1][0] == i and out_list[len(out_list)-1][1][0] == j[0] and out_list[len(out_list)-1][1][1] == j[1]:
+                            pass #if in list do not add it again as it is redundant
                         else:
-                            #if join flag is absent check if the current start-end postion for that chromosome already is in list
-                            if len(out_list)>0 and out_list[len(out_list)-1][0] == i and out_list[len(out_list)-1][1][0] == j[0] and out_list[len(out_list)-1][1][1] == j[1]:
-                                pass #if in list do not add it again as it is redundant
-                            else:
-                                #if not in list add the chromosme name and the start-end position from input1
-                                out_list.append([i,j])
+                            #if not in list add the chromosme name and the start-end position from input1
+                            out_list.append([i,j])
     return out_list #return the overlaped list
 
 #helper function to generate the output containing overlaped info in correct format and given a file name and overlap list and a README file with the number of overlapped matches
@@ -3,19 +3,69 @@
 #Description: This program performs the Smith-Waterman local sequence alignment for 2 input fasta files and prints out the alignment with an alignment score
 #             This uses a fixed scoring matrix with -1 for mismatch or gap and +1 for match
 
+import argparse
+import concurrent.futures
+import functools
+import heapq
+import os
 import sys
+import numpy as np
+from align_traceback import PackedTraceback, NONE, DIAG, UP, LEFT
+import align_batch
+import align_server
+import fasta_index
 
-#helper function to read fasta sequence from file path
-def read_sequence(seq_file_path):
-    seq_file = open(seq_file_path,'r') #opens fasta file in read mode
-    seq_contents = seq_file.readlines() #stores file lines in list
-    seq_file.close() #closes file
-    seq_string = ' ' #adds empty character at beginning (important when we align the 2D grid for alignment)
-    
-    #for loop scans all the lines except for the header and concatenates it to the seq_string it while removing any new line characters
-    for i in range(1,len(seq_contents)):
-        seq_contents[i] = str.replace(seq_contents[i],'\n','')
-        seq_string += seq_contents[i]
+#fixed scoring values used by the vectorized engines (same values get_cordinate_value uses)
+MATCH = 1
+MISMATCH = -1
+GAP = -1
+
+#number of segments the striped kernel splits seq1 into, each segment is one NumPy vector holding one position of every stripe
+STRIPE_SEGMENTS = 8
+#smallest number of cells for which the auto engine keeps only 2 score rows (score_only and a window traceback) instead of the full vectorized grid
+#the striped kernel is slower than score_only at every size measured with align_benchmark.py so it is only used when asked for (-e striped)
+STREAM_MIN_CELLS = 1<<22
+
+#number of cells added before the begining of an alignment when its window is filled for the traceback (doubled while the traceback reaches the border)
+TRACEBACK_PAD = 16
+
+#number of database residues sent to a worker at once in database search mode
+SEARCH_CHUNK = 1<<20
+
+#lowest score reported in Waterman-Eggert mode unless --min-score is given
+MIN_ALIGNMENT_SCORE = 10
+#number of cells first added when a changed value keeps spreading to the right while the score matrix is recomputed in Waterman-Eggert mode
+#(doubled every time the change reaches the end of the recomputed cells)
+RECOMPUTE_CHUNK = 256
+
+#k-mer length and minimum number of seed hits in a diagonal bin for each sensitivity level of the seed prefilter (nucleotide and protein sequences)
+NUCLEOTIDE_SEEDS = {'fast':(16,3),'default':(11,2),'sensitive':(7,1)}
+PROTEIN_SEEDS = {'fast':(5,2),'default':(4,2),'sensitive':(3,1)}
+#width of the diagonal bins seed hits are grouped in (small indels keep hits of one alignment in the same bin)
+DIAGONAL_BIN = 16
+#k-mers found more often than this in the target are treated as repeats and ignored
+MAX_KMER_OCCURRENCES = 64
+
+#query and prefilter sensitivity, set in every worker process by init_search_worker
+search_query = None
+
+#helper function to read fasta sequence from file path, region picks a record or part of one (chr1:1000-5000), the first record is used by default
+#the file is memory mapped through its .fai index so only the requested bases are read, files with lines of different lengths can not be indexed
+#and are read line by line instead
+def read_sequence(seq_file_path,region=None):
+    try:
+        fasta = fasta_index.FastaIndex(seq_file_path)
+    except ValueError:
+        return ' ' + fasta_index.read_unindexed(seq_file_path,region)
+    if region != None:
+        bases = fasta.fetch_region(region)
+    elif len(fasta) > 0:
+        bases = fasta.fetch_array(fasta.names[0])
+    else:
+        bases = b''
+    seq_string = ' ' + bytes(bases).decode('latin-1') #adds empty character at beginning (important when we align the 2D grid for alignment)
+    del bases
+    fasta.close()
     return seq_string #sequence string is returned
 
 #generates a 2D grid whose dimensions is equal to the 2 sequence lengths (contains current score and previous direction (Diagonal,Left,Up))
@@ -74,6 +124,229 @@ def traverse_grid(grid,seq1,seq2):
         y+=1
     return (grid,start) #return tuple of that grid and the starting point containing the coordinates of the maximum value
 
+#helper function to convert a sequence string into an array of byte values so whole rows can be compared at once
+def encode_sequence(seq):
+    return np.frombuffer(seq.encode('latin-1'),dtype=np.uint8)
+
+#helper function to build the score profile (match or mismatch value against every character of seq1) for each distinct character of seq2
+def get_profile(seq1,seq2):
+    s1 = encode_sequence(seq1)
+    profile = {}
+    for c in set(seq2[1:]):
+        profile[c] = np.where(s1[1:] == ord(c),MATCH,MISMATCH)
+    return profile
+
+#helper function to compute the next row of the grid from the previous one with integer arrays, the left gaps inside the row are resolved with a running
+#maximum since H[x] = max(0, best diagonal/up value at k + GAP*(x-k)) for k <= x. Returns the new row together with the diagonal, up and left values
+#first is the value of the first column (always 0 in the full grid, a known cell of the full grid when a window is filled)
+def next_row(row,scores,offsets,t,first=0):
+    diag = row[:-1] + scores
+    up = row[1:] + GAP
+    t[0] = first
+    t[1:] = np.maximum(np.maximum(diag,up),0) - offsets[1:]
+    acc = np.maximum.accumulate(t)
+    left = acc[:-1] + offsets[1:] #value coming from the left cell (H[x-1] + GAP)
+    return (acc + offsets,diag,up,left)
+
+#helper function to get the direction codes of a row from its diagonal, up and left values, the first column has no direction
+def get_direction_codes(diag,up,left):
+    codes = np.where(up >= diag,UP,DIAG)
+    codes = np.where(left >= np.maximum(diag,up),LEFT,codes)
+    codes = np.where(np.maximum(np.maximum(diag,up),left) < 0,NONE,codes) #cells where every value is negative have no direction
+    return np.concatenate(([NONE],codes))
+
+#vectorized version of generate_grid + traverse_grid, the grid is filled one row at a time and the direction of every cell is kept in a uint8 array
+#ties are broken the same way as get_cordinate_value (the last of Diagonal, Up, Left reaching the maximum wins) and the maximum cell is the first one found
+def fill_grid_numpy(seq1,seq2):
+    cols = len(seq1)
+    grid = PackedTraceback(len(seq2),cols) #2 bits per cell instead of a [score, direction] list, first row has no directions
+    offsets = GAP*np.arange(cols,dtype=np.int64)
+    row = np.zeros(cols,dtype=np.int64) #first row is all 0 with no direction
+    profile = get_profile(seq1,seq2)
+    t = np.empty(cols,dtype=np.int64)
+    start = [0,0,0]
+    for y in range(1,len(seq2)):
+        row,diag,up,left = next_row(row,profile[seq2[y]],offsets,t)
+        grid.set_row(y,get_direction_codes(diag,up,left))
+        best = row.max()
+        if best > start[0]:
+            start = [int(best),int(np.argmax(row)),y]
+    grid.scores[(start[2],start[1])] = start[0]
+    return (grid,start)
+
+#score only version of fill_grid_numpy that keeps just 2 integer rows, returns the same [score, x, y] start list as traverse_grid
+def score_only(seq1,seq2):
+    cols = len(seq1)
+    offsets = GAP*np.arange(cols,dtype=np.int64)
+    row = np.zeros(cols,dtype=np.int64)
+    profile = get_profile(seq1,seq2)
+    t = np.empty(cols,dtype=np.int64)
+    start = [0,0,0]
+    for y in range(1,len(seq2)):
+        row = next_row(row,profile[seq2[y]],offsets,t)[0]
+        best = row.max()
+        if best > start[0]:
+            start = [int(best),int(np.argmax(row)),y]
+    return start
+
+#helper function to build the striped query profile of seq1 for the striped kernel. Position x of seq1 (0 based, without the empty character) is stored
+#in segment x % segments of lane x // segments, so moving to the next segment moves every lane one position forward in the sequence
+#the profile scores for each character are computed the first time the character is seen and cached for every integer width
+def build_query_profile(seq1):
+    length = len(seq1)-1
+    segments = max(1,min(STRIPE_SEGMENTS,length))
+    lanes = -(-length//segments) #ceiling division
+    stripes = np.zeros(segments*lanes,dtype=np.uint8)
+    stripes[:length] = encode_sequence(seq1)[1:]
+    return {'stripes':stripes.reshape(lanes,segments).T.copy(),'length':length,'scores':{}}
+
+#helper function to get the striped match/mismatch scores of a character against the query in the given integer width
+def get_striped_scores(query,c,dtype):
+    key = (c,dtype)
+    if key not in query['scores']:
+        query['scores'][key] = np.where(query['stripes'] == ord(c),MATCH,MISMATCH).astype(dtype)
+    return query['scores'][key]
+
+#score only Smith-Waterman in the style of Farrar's striped algorithm, seq2 is scanned one row at a time while seq1 is processed as striped vectors
+#up (E) values come from the previous row of the same vector, left (F) values are passed from one segment to the next and a lazy F loop fixes the lanes
+#where a left gap crosses from the last segment into the next lane. Scores start as int16 and are widened to int32 before they can overflow.
+#returns the same [score, x, y] start list as traverse_grid. Opt-in engine (-e striped): the NumPy calls per segment make it slower than score_only
+def striped_score(query,seq2):
+    start = [0,0,0]
+    length = query['length']
+    if length == 0:
+        return start
+    segments,lanes = query['stripes'].shape
+    padding = length - (lanes-1)*segments #first padded segment of the last lane
+    dtype = np.int16
+    limit = np.iinfo(dtype).max - MATCH #highest score a row can reach before the next row may overflow
+    load = np.zeros((segments,lanes),dtype=dtype) #previous row
+    store = np.zeros((segments,lanes),dtype=dtype) #current row
+    vH = np.empty(lanes,dtype=dtype)
+    vE = np.empty(lanes,dtype=dtype)
+    vF = np.empty(lanes,dtype=dtype)
+    for y in range(1,len(seq2)):
+        scores = get_striped_scores(query,seq2[y],dtype)
+        vF[:] = 0 #left gaps can never make a cell negative so 0 acts as minus infinity
+        vH[1:] = load[-1,:-1] #diagonal of the first segment is the last segment of the previous lane
+        vH[0] = 0
+        for i in range(segments):
+            vH += scores[i]
+            np.add(load[i],GAP,out=vE)
+            np.maximum(vH,vE,out=vH)
+            np.maximum(vH,vF,out=vH)
+            np.maximum(vH,0,out=vH)
+            store[i] = vH
+            np.add(vH,GAP,out=vF)
+            vH[:] = load[i] #diagonal of the next segment
+        #lazy F loop, left gaps leaving the last segment continue in the first segment of the next lane until they stop improving any cell
+        vF[1:] = vF[:-1].copy()
+        vF[0] = 0
+        i = 0
+        while (vF > store[i]).any():
+            np.maximum(store[i],vF,out=store[i])
+            np.add(store[i],GAP,out=vF)
+            i += 1
+            if i == segments:
+                vF[1:] = vF[:-1].copy()
+                vF[0] = 0
+                i = 0
+        store[padding:,-1] = 0 #padding cells after the end of seq1 are kept at 0 so they never count as the best cell
+        load,store = store,load
+        best = load.max()
+        if best > start[0]:
+            row = load.T.reshape(-1)[:length] #unstripe the row only when it holds a new best cell
+            start = [int(best),int(np.argmax(row))+1,y]
+        if best > limit and dtype == np.int16:
+            #scores are close to saturating the 16 bit lanes so the rest of the grid is computed with 32 bit lanes
+            dtype = np.int32
+            limit = np.iinfo(dtype).max - MATCH
+            load = load.astype(dtype)
+            store = store.astype(dtype)
+            vH = vH.astype(dtype)
+            vE = vE.astype(dtype)
+            vF = vF.astype(dtype)
+    return start
+
+#helper function to find where the best local alignment ending at the start cell begins. The prefixes ending at that cell are reversed and aligned
+#from their first characters without resetting scores to 0, the first row where a cell reaches the best score gives the begining of the alignment
+def find_alignment_begin(seq1,seq2,start):
+    score,x_end,y_end = start
+    rev1 = seq1[x_end:0:-1] #prefix of seq1 up to the end cell in reverse order
+    rev2 = seq2[y_end:0:-1]
+    s1 = encode_sequence(rev1)
+    offsets = GAP*np.arange(len(rev1)+1,dtype=np.int64)
+    row = offsets.copy()
+    t = np.empty(len(rev1)+1,dtype=np.int64)
+    profile = {}
+    for y in range(1,len(rev2)+1):
+        c = rev2[y-1]
+        if c not in profile:
+            profile[c] = np.where(s1 == ord(c),MATCH,MISMATCH)
+        t[0] = row[0] + GAP
+        t[1:] = np.maximum(row[:-1] + profile[c],row[1:] + GAP) - offsets[1:]
+        row = np.maximum.accumulate(t) + offsets
+        if row.max() >= score:
+            x = int(np.argmax(row >= score))
+            return (x_end - x + 1,y_end - y + 1)
+    return (1,1)
+
+#helper function to get the values of the full grid on the first row (row y_first, columns x_first to x_end) and first column (column x_first, rows
+#y_first to y_end) of a window. Only the columns up to x_end and rows up to y_end are computed since no cell depends on a cell right of or below it
+def get_window_border(seq1,seq2,x_first,x_end,y_first,y_end):
+    prefix = seq1[:x_end+1]
+    cols = len(prefix)
+    offsets = GAP*np.arange(cols,dtype=np.int64)
+    row = np.zeros(cols,dtype=np.int64)
+    profile = get_profile(prefix,seq2[:y_end+1])
+    t = np.empty(cols,dtype=np.int64)
+    column = np.zeros(y_end-y_first+1,dtype=np.int64)
+    top = row[x_first:].copy()
+    for y in range(1,y_end+1):
+        row = next_row(row,profile[seq2[y]],offsets,t)[0]
+        if y == y_first:
+            top = row[x_first:].copy()
+        if y >= y_first:
+            column[y-y_first] = row[x_first]
+    return (top,column)
+
+#helper function to fill the traceback grid of a window whose first row and column hold the values of the full grid (top and column from
+#get_window_border), every cell inside the window then gets the same direction as in the full grid
+def fill_window_grid(seq1,seq2,top,column):
+    cols = len(seq1)
+    grid = PackedTraceback(len(seq2),cols)
+    offsets = GAP*np.arange(cols,dtype=np.int64)
+    row = top
+    profile = get_profile(seq1,seq2)
+    t = np.empty(cols,dtype=np.int64)
+    for y in range(1,len(seq2)):
+        row,diag,up,left = next_row(row,profile[seq2[y]],offsets,t,column[y])
+        grid.set_row(y,get_direction_codes(diag,up,left))
+    return grid
+
+#helper function to get the local alignment in O(n) memory: the best score and its end cell come from score_only, the begining of the alignment from
+#find_alignment_begin and only a window between them is filled with a traceback grid. The border of the window holds the values of the full grid so
+#the traceback takes the same path as get_alignment on the full grid, including the cells with a score of 0 it keeps going through. When the
+#traceback reaches the border of the window the window is made larger. Returns the same tuple as get_alignment
+def get_alignment_window(seq1,seq2,start):
+    if start[0] == 0:
+        return ([],0)
+    x_begin,y_begin = find_alignment_begin(seq1,seq2,start)
+    pad = TRACEBACK_PAD
+    while True:
+        x_first = max(0,x_begin-1-pad) #first column and row of the window are cells of the full grid before the alignment
+        y_first = max(0,y_begin-1-pad)
+        top,column = get_window_border(seq1,seq2,x_first,start[1],y_first,start[2])
+        window1 = ' ' + seq1[x_first+1:start[1]+1]
+        window2 = ' ' + seq2[y_first+1:start[2]+1]
+        grid = fill_window_grid(window1,window2,top,column)
+        alignment,score = get_alignment(grid,[start[0],start[1]-x_first,start[2]-y_first],window1,window2)
+        x_stop = start[1]-x_first-sum(1 for i in alignment if i[2] != '-') #window cell the traceback stopped at
+        y_stop = start[2]-y_first-sum(1 for i in alignment if i[0] != '-')
+        if (x_stop > 0 or x_first == 0) and (y_stop > 0 or y_first == 0):
+            return (alignment,score)
+        pad *= 2
+
 #helper function to traceback the finalized grid and determine the sequence alignment along with the alignment score
 def get_alignment(grid,start,seq1,seq2):
 
@@ -121,17 +394,276 @@ def format_alignment(alignment):
     formated = seq1_format+'\n'+align_notation+'\n'+seq2_format #concatenates the 3 generated strings by separating them with a new line character
     return formated
 
-#reads the sequences from 2 input fasta files from command line
-seq1 = read_sequence(sys.argv[1])
-seq2 = read_sequence(sys.argv[2])
+#helper function used by the batch mode to align one pair of sequences with the engine of the command line, pairs without enough seed hits are skipped
+#when a prefilter sensitivity is given. Returns the alignment, the score and the end of the alignment in both sequences or None for a skipped pair
+def align_pair(seq1,seq2,engine='auto',sensitivity=None):
+    if sensitivity != None and len(find_seed_windows(seq1,seq2,sensitivity)) == 0:
+        return None #skipped by the seed prefilter
+    return get_local_alignment(seq1,seq2,engine)
+
+#helper function to find the best local alignment with the chosen engine (same engines as the command line, auto uses stream for long inputs and numpy
+#otherwise), returns (alignment, score, (end in seq1, end in seq2))
+def get_local_alignment(seq1,seq2,engine='auto'):
+    if engine == 'auto':
+        engine = 'stream' if (len(seq1)-1)*(len(seq2)-1) >= STREAM_MIN_CELLS else 'numpy'
+    if engine == 'grid':
+        grid,start = traverse_grid(generate_grid(seq1,seq2),seq1,seq2)
+        align = get_alignment(grid,start,seq1,seq2)
+    elif engine == 'numpy':
+        grid,start = fill_grid_numpy(seq1,seq2)
+        align = get_alignment(grid,start,seq1,seq2)
+    elif engine == 'striped' or engine == 'stream':
+        start = striped_score(build_query_profile(seq1),seq2) if engine == 'striped' else score_only(seq1,seq2)
+        align = get_alignment_window(seq1,seq2,start) #traceback only the aligned window
+    else:
+        raise ValueError('Unknown engine: '+str(engine))
+    return (align[0],align[1],(start[1],start[2]))
+
+#importable version of the command line alignment, seq1 and seq2 are plain sequence strings (without the empty character at the begining)
+#returns a dictionary with the score, the aligned sequences with gaps, the notation line, the 1 based begin and end in both sequences and the identity
+def align_local(seq1,seq2,engine='auto'):
+    alignment,score,end = get_local_alignment(' ' + seq1,' ' + seq2,engine)
+    return align_batch.alignment_to_dict(alignment,score,end)
+
+#helper function to fill the whole score matrix (one integer per cell, 16 bits when the best possible score fits) for Waterman-Eggert mode
+def fill_score_matrix(seq1,seq2,profile):
+    cols = len(seq1)
+    dtype = np.int16 if min(len(seq1),len(seq2))*MATCH < np.iinfo(np.int16).max else np.int32
+    matrix = np.zeros((len(seq2),cols),dtype=dtype)
+    offsets = GAP*np.arange(cols,dtype=np.int64)
+    row = np.zeros(cols,dtype=np.int64)
+    t = np.empty(cols,dtype=np.int64)
+    for y in range(1,len(seq2)):
+        row = next_row(row,profile[seq2[y]],offsets,t)[0]
+        matrix[y] = row
+    return matrix
+
+#helper function to compute the cells lo to hi (inclusive, lo > 0) of row y of the score matrix from the previous row and the cell left of lo
+#masked cells (cells used by an alignment that was already reported) are 0 and the left gap running maximum restarts after each of them
+def masked_row_segment(matrix,mask,scores,y,lo,hi):
+    above = matrix[y-1,lo-1:hi+1].astype(np.int64)
+    offsets = GAP*np.arange(hi-lo+2,dtype=np.int64)
+    t = np.empty(hi-lo+2,dtype=np.int64)
+    t[0] = matrix[y,lo-1] #cell left of the segment, its value reaches the segment through left gaps
+    t[1:] = np.maximum(np.maximum(above[:-1] + scores[lo-1:hi],above[1:] + GAP),0) - offsets[1:]
+    masked = mask[y,lo:hi+1]
+    if not masked.any():
+        return (np.maximum.accumulate(t) + offsets)[1:]
+    #every masked cell starts a new segment, adding a step larger than any score difference per segment keeps the running maximum from reaching
+    #back past the last masked cell
+    t[1:][masked] = -offsets[1:][masked]
+    step = 2*(len(matrix)+matrix.shape[1])*max(MATCH,-GAP)
+    segments = np.concatenate(([0],np.cumsum(masked)))*step
+    return (np.maximum.accumulate(t + segments) - segments + offsets)[1:]
+
+#helper function to traceback the score matrix from the cell (x,y), directions are worked out from the scores with the same tie breaking as
+#get_cordinate_value and the traceback stops at masked cells. Returns the alignment in the same format as get_alignment and the list of (y,x) cells used
+def traceback_matrix(matrix,mask,profile,seq1,seq2,x,y):
+    alignment = []
+    cells = []
+    while x > 0 and y > 0 and not mask[y,x]:
+        diag = int(matrix[y-1,x-1]) + int(profile[seq2[y]][x-1])
+        up = int(matrix[y-1,x]) + GAP
+        left = int(matrix[y,x-1]) + GAP
+        if max(diag,up,left) < 0:
+            break #cell with no direction
+        cells.append((y,x))
+        if left >= max(diag,up):
+            x -= 1
+            alignment.append(['-',' ',seq1[x+1]])
+        elif up >= diag:
+            y -= 1
+            alignment.append([seq2[y+1],' ','-'])
+        else:
+            x -= 1
+            y -= 1
+            alignment.append([seq2[y+1],'|' if seq1[x+1] == seq2[y+1] else '*',seq1[x+1]])
+    return (alignment,cells)
+
+#helper function to mask the cells of a reported alignment and recompute only the part of the score matrix below and right of them that changes
+#row by row: a row is recomputed from the first masked or changed column of the row above, and stops after the last one unless the change keeps
+#spreading to the right through left gaps. The maximum of every changed row is updated in row_max
+def recompute_matrix(matrix,mask,profile,seq2,cells,row_max):
+    cols = matrix.shape[1]
+    masked_columns = {} #(first, last) masked column of each row
+    for y,x in cells:
+        mask[y,x] = True
+        first,last = masked_columns.get(y,(x,x))
+        masked_columns[y] = (min(first,x),max(last,x))
+    last_row = max(masked_columns)
+    changed = None #(first, last) changed column of the previous row
+    for y in range(min(masked_columns),len(matrix)):
+        if changed == None and y not in masked_columns:
+            if y > last_row:
+                break
+            continue
+        lo,hi = masked_columns.get(y,(cols,0))
+        if changed != None:
+            lo = min(lo,changed[0])
+            hi = max(hi,min(cols-1,changed[1]+1))
+        changed = None
+        extend = RECOMPUTE_CHUNK
+        while True:
+            row = masked_row_segment(matrix,mask,profile[seq2[y]],y,lo,hi)
+            diff = np.flatnonzero(row != matrix[y,lo:hi+1])
+            matrix[y,lo:hi+1] = row
+            if len(diff) > 0:
+                changed = (lo+int(diff[0]) if changed == None else changed[0],lo+int(diff[-1]))
+            if len(diff) == 0 or diff[-1] != hi-lo or hi == cols-1:
+                break
+            lo,hi = hi+1,min(cols-1,hi+extend)
+            extend *= 2
+        if changed != None or y in masked_columns:
+            row_max[y] = matrix[y].max()
+
+#Waterman-Eggert mode, finds up to count non intersecting local alignments (no cell is used by 2 alignments) with a score of at least min_score
+#the score matrix is filled once and after each traceback only the region changed by masking the aligned cells is recomputed. The first alignment is
+#the same one get_alignment returns. Returns a list of (alignment, score, (end in seq1, end in seq2)) tuples from best to worst
+def get_local_alignments(seq1,seq2,count,min_score=MIN_ALIGNMENT_SCORE):
+    profile = get_profile(seq1,seq2)
+    matrix = fill_score_matrix(seq1,seq2,profile)
+    mask = np.zeros(matrix.shape,dtype=bool)
+    row_max = matrix.max(axis=1)
+    alignments = []
+    while len(alignments) < count:
+        y = int(np.argmax(row_max)) #first row with the best score, and the first cell of that row, like traverse_grid
+        score = int(row_max[y])
+        if score < max(min_score,1):
+            break
+        x = int(np.argmax(matrix[y]))
+        alignment,cells = traceback_matrix(matrix,mask,profile,seq1,seq2,x,y)
+        alignments.append((alignment,score,(x,y)))
+        recompute_matrix(matrix,mask,profile,seq2,cells,row_max)
+    return alignments
+
+#helper function to check if a sequence (with the empty character at the begining) only holds nucleotides
+def is_nucleotide(seq):
+    return set(seq[1:].upper()) <= set('ACGTUN')
+
+#helper function to get the k-mer length and minimum number of seed hits, shorter k-mers are used when the query is not a nucleotide sequence
+def get_seed_settings(seq1,sensitivity):
+    if is_nucleotide(seq1):
+        return NUCLEOTIDE_SEEDS[sensitivity]
+    return PROTEIN_SEEDS[sensitivity]
+
+#helper function to build a hash index of every k-mer of the target with a list of the positions (grid rows) where it starts
+def build_kmer_index(seq2,k):
+    index = {}
+    for y in range(1,len(seq2)-k+1):
+        kmer = seq2[y:y+k]
+        if kmer in index:
+            index[kmer].append(y)
+        else:
+            index[kmer] = [y]
+    return index
+
+#helper function to find the windows of the grid worth aligning. Every k-mer of the query found in the target index is a seed hit on diagonal x - y,
+#hits are grouped in diagonal bins and each bin with at least min_hits seeds gives a window [x begin, x end, y begin, y end] around its seeds
+def find_seed_windows(seq1,seq2,sensitivity='default',index=None):
+    k,min_hits = get_seed_settings(seq1,sensitivity)
+    if index == None:
+        index = build_kmer_index(seq2,k)
+    bins = {} #diagonal bin as key and [number of hits, x begin, x end, y begin, y end] of its seeds as value
+    for x in range(1,len(seq1)-k+1):
+        positions = index.get(seq1[x:x+k])
+        if positions == None or len(positions) > MAX_KMER_OCCURRENCES:
+            continue
+        for y in positions:
+            b = (x-y)//DIAGONAL_BIN
+            if b in bins:
+                hit = bins[b]
+                hit[0] += 1
+                hit[1] = min(hit[1],x)
+                hit[2] = max(hit[2],x+k-1)
+                hit[3] = min(hit[3],y)
+                hit[4] = max(hit[4],y+k-1)
+            else:
+                bins[b] = [1,x,x+k-1,y,y+k-1]
+    windows = []
+    for b in sorted(bins.keys()):
+        if bins[b][0] >= min_hits:
+            windows.append(bins[b][1:])
+    return windows
+
+#seed version of score_only, pairs without a diagonal with enough seed hits are skipped. The seeds only decide which pairs are scored: the best local
+#alignment of a pair does not have to hold a seed (a long region with a mismatch every few residues has none) and can lie outside of every window
+#around the seed hits, so every pair that passes the prefilter is scored with score_only on the whole grid. Returns the same [score, x, y] start list
+#as traverse_grid or None when no diagonal has enough seed hits
+def seeded_score(seq1,seq2,sensitivity='default',index=None):
+    if len(find_seed_windows(seq1,seq2,sensitivity,index)) == 0:
+        return None
+    return score_only(seq1,seq2)
+
+#runs once in every database search worker, the query is only sent once per worker
+def init_search_worker(seq1,sensitivity=None):
+    global search_query
+    search_query = (seq1,sensitivity)
+
+#scores every record of a database chunk against the query with the two row score only kernel (the fastest one, see align_benchmark.py), returns the
+#[score, x, y] start list of each record. When the seed prefilter is used records without enough seed hits get None
+def search_chunk(chunk):
+    if search_query[1] != None:
+        return [seeded_score(search_query[0],' '+i[1],search_query[1]) for i in chunk]
+    return [score_only(search_query[0],' '+i[1]) for i in chunk]
 
-#initilaize a 2D grid for the 2 sequences and travserse the grid accordingly with the correct score and driection of previous cell   
-grid = generate_grid(seq1, seq2)
-grid = traverse_grid(grid, seq1, seq2)
-align = get_alignment(grid[0],grid[1],seq1,seq2) #traceback the grid to get the alignment
-print('Score:',align[1]) #print the alignment score
-print(format_alignment(align)) #print the alignment properly formated
+#helper function to group the records of a multi fasta file into chunks of about SEARCH_CHUNK residues without reading the whole file
+def read_chunks(path,chunk_size):
+    chunk = []
+    size = 0
+    for record in align_batch.read_records(path):
+        chunk.append(record)
+        size += len(record[1])
+        if size >= chunk_size:
+            yield chunk
+            chunk = []
+            size = 0
+    if len(chunk) > 0:
+        yield chunk
 
+#searches the query against every record of a multi fasta database. Chunks of records are scored on a pool of workers with only a few chunks in flight
+#at once, a min-heap keeps the best top_hits records and the full traceback is only done for those. Writes a TSV line for each hit from best to worst
+def search_database(seq1,database_path,top_hits=10,workers=None,chunk_size=SEARCH_CHUNK,out=sys.stdout,sensitivity=None):
+    workers = workers if workers != None else os.cpu_count()
+    heap = [] #min-heap of (score, -record number, ID, sequence, start) so the worst hit is always at the top and earlier records win ties
+    order = 0
+    chunks = read_chunks(database_path,chunk_size)
+    executor = concurrent.futures.ProcessPoolExecutor(workers,initializer=init_search_worker,initargs=(seq1,sensitivity))
+    try:
+        pending = {}
+        finished = False
+        while True:
+            #keeps at most 2 chunks per worker in flight so memory stays flat no matter how large the database is
+            while not finished and len(pending) < 2*workers:
+                chunk = next(chunks,None)
+                if chunk == None:
+                    finished = True
+                    break
+                pending[executor.submit(search_chunk,chunk)] = (order,chunk)
+                order += len(chunk)
+            if len(pending) == 0:
+                break
+            done = concurrent.futures.wait(pending,return_when=concurrent.futures.FIRST_COMPLETED)[0]
+            for future in done:
+                first,chunk = pending.pop(future)
+                starts = future.result()
+                for i in range(0,len(chunk)):
+                    if starts[i] == None:
+                        continue #skipped by the seed prefilter
+                    hit = (starts[i][0],-(first+i),chunk[i][0],chunk[i][1],starts[i])
+                    if len(heap) < top_hits:
+                        heapq.heappush(heap,hit)
+                    elif hit > heap[0]:
+                        heapq.heapreplace(heap,hit)
+    finally:
+        executor.shutdown()
+
+    out.write('#id\tscore\tquery_start\tquery_end\tstart\tend\tidentity\n')
+    for score,rank,seq_id,sequence,start in sorted(heap,reverse=True):
+        alignment = get_alignment_window(seq1,' '+sequence,start)[0] #full traceback only for the final hits
+        start1,end1,start2,end2,identity = align_batch.summarize_alignment(alignment,(start[1],start[2]))
+        out.write(seq_id+'\t'+str(score)+'\t'+str(start1)+'\t'+str(end1)+'\t'+str(start2)+'\t'+str(end2)+'\t'+'%.4f' % identity+'\n')
+
+#helper function to print the grid with the sequence characters along its sides (used for debugging)
 def print_grid_space(grid,seq1,seq2):
     h_str = '     '
     for i in seq1:
@@ -142,4 +674,122 @@ def print_grid_space(grid,seq1,seq2):
         print(seq2[j],i)
         j+=1
 
-#print_grid_space(grid[0], seq1, seq2)
+#command line interface, only runs when the script is executed directly so the helper functions can be imported (and used by worker processes)
+if __name__ == '__main__':
+    #parses the 2 input fasta files, the engine used to fill the grid and the score only flag
+    parser = argparse.ArgumentParser(description="Smith-Waterman local alignment of 2 fasta files")
+    parser.add_argument('seq1',type=str,nargs='?',help='Enter the first input fasta file (not used in server mode)')
+    parser.add_argument('seq2',type=str,nargs='?',help='Enter the second input fasta file (optional in batch mode)')
+    parser.add_argument('-e',metavar='--engine',type=str,default='auto',choices=['auto','numpy','striped','stream','grid'],help='Enter the engine used to fill the grid <numpy> vectorized full grid, <stream> 2 score rows and a traceback of the aligned window only, <striped> experimental striped score kernel (slower than stream) and a traceback of the aligned window only, or <grid> original nested list grid. Default <auto> uses stream for long inputs and numpy otherwise')
+    parser.add_argument('-s','--score-only',action='store_true',help='Only print the best score and the coordinates of the cell the alignment ends at')
+    parser.add_argument('-m','--multi',action='store_true',help='Batch mode, align every pair of records of the first multi fasta file, or every record of the first file against every record of the second one, and write a TSV with the results')
+    parser.add_argument('-p','--pairs',type=str,help='Enter a file with one pair of sequence IDs per line to align only those pairs in batch mode')
+    parser.add_argument('-w','--workers',type=int,default=os.cpu_count(),help='Enter the number of worker processes used in batch mode (Default number of CPUs)')
+    parser.add_argument('-o','--output',type=str,help='Enter the TSV output file for batch and database search mode (Default prints to console)')
+    parser.add_argument('--region1',type=str,help='Enter the record or region of the first fasta file to align, <name> or <name:begin-end> (1 based, inclusive, Default first record)')
+    parser.add_argument('--region2',type=str,help='Enter the record or region of the second fasta file to align, <name> or <name:begin-end> (1 based, inclusive, Default first record)')
+    parser.add_argument('--serve',type=str,metavar='SOCKET',help='Server mode, answer JSON line alignment requests on this Unix socket with a pool of -w worker processes')
+    parser.add_argument('-d','--database',type=str,help='Database search mode, search the first sequence of seq1 against every record of this multi fasta file')
+    parser.add_argument('-k','--top-hits',type=int,default=10,help='Enter the number of best database hits to report (Default 10)')
+    parser.add_argument('-c','--chunk-size',type=int,default=SEARCH_CHUNK,help='Enter the number of database residues scored by a worker at once')
+    parser.add_argument('-f','--prefilter',action='store_true',help='Skip pairs without a diagonal with enough k-mer seed hits, the other pairs are scored on the whole grid')
+    parser.add_argument('-a','--alignments',type=int,help='Waterman-Eggert mode, enter the number of best non intersecting local alignments to report')
+    parser.add_argument('--min-score',type=int,default=MIN_ALIGNMENT_SCORE,help='Enter the lowest score of the alignments reported in Waterman-Eggert mode (Default '+str(MIN_ALIGNMENT_SCORE)+')')
+    parser.add_argument('--sensitivity',type=str,default='default',choices=['fast','default','sensitive'],help='Enter the sensitivity of the seed prefilter <fast> long k-mers, <default>, or <sensitive> short k-mers and a single seed hit')
+
+    args = parser.parse_args()
+
+    #server mode keeps the workers running and aligns the pairs sent to the socket
+    if args.serve != None:
+        align_server.serve(args.serve,align_local,args.workers)
+        exit(0)
+    if args.seq1 == None:
+        print('The first input fasta file is required unless server mode is used!')
+        exit(1)
+
+    #database search mode streams the database through a pool of workers and only keeps the best hits
+    if args.database != None:
+        if args.top_hits < 1 or args.chunk_size < 1:
+            print('Number of hits and chunk size must be larger than 0!')
+            exit(1)
+        out = open(args.output,'w') if args.output != None else sys.stdout
+        search_database(read_sequence(args.seq1,args.region1),args.database,args.top_hits,args.workers,args.chunk_size,out,args.sensitivity if args.prefilter else None)
+        if out != sys.stdout:
+            out.close()
+        exit(0)
+
+    #batch mode aligns all pairs of records on a pool of worker processes with the engine and prefilter options of the command line
+    if args.multi:
+        out = open(args.output,'w') if args.output != None else sys.stdout
+        align_function = functools.partial(align_pair,engine=args.e,sensitivity=args.sensitivity if args.prefilter else None)
+        align_batch.run_batch(align_function,args.seq1,args.seq2,args.pairs,args.workers,out)
+        if out != sys.stdout:
+            out.close()
+        exit(0)
+    if args.seq2 == None:
+        print('The second input fasta file is required unless batch or database search mode is used!')
+        exit(1)
+
+    #reads the sequences from 2 input fasta files from command line
+    try:
+        seq1 = read_sequence(args.seq1,args.region1)
+        seq2 = read_sequence(args.seq2,args.region2)
+    except (KeyError,ValueError) as error:
+        print(error.args[0])
+        exit(1)
+
+    #Waterman-Eggert mode reports the best non intersecting local alignments one after the other
+    if args.alignments != None:
+        if args.alignments < 1:
+            print('Number of alignments must be larger than 0!')
+            exit(1)
+        alignments = get_local_alignments(seq1,seq2,args.alignments,args.min_score)
+        if len(alignments) == 0:
+            print('No alignment with a score of at least',args.min_score)
+        for i in range(0,len(alignments)):
+            alignment,score,end = alignments[i]
+            start1,end1,start2,end2,identity = align_batch.summarize_alignment(alignment,end)
+            print('Alignment',i+1)
+            print('Score:',score)
+            print('Begin:',start1,start2) #position the alignment begins at in the first and second sequence
+            print('End:',end1,end2)
+            print(format_alignment((alignment,score)))
+            print()
+        exit(0)
+
+    #picks the engine for the auto mode based on the number of cells in the grid
+    engine = args.e
+    if engine == 'auto':
+        if (len(seq1)-1)*(len(seq2)-1) >= STREAM_MIN_CELLS:
+            engine = 'stream'
+        else:
+            engine = 'numpy'
+
+    #initilaize a 2D grid for the 2 sequences and travserse the grid accordingly with the correct score and driection of previous cell   
+    if args.prefilter:
+        grid = (None,seeded_score(seq1, seq2, args.sensitivity)) #only the best cell is known like the score only mode
+        if grid[1] == None:
+            print('No diagonal with enough seed hits, pair skipped')
+            exit(0)
+    elif engine == 'grid':
+        grid = generate_grid(seq1, seq2)
+        grid = traverse_grid(grid, seq1, seq2)
+    elif engine == 'numpy' and not args.score_only:
+        grid = fill_grid_numpy(seq1, seq2)
+    elif engine == 'striped':
+        grid = (None,striped_score(build_query_profile(seq1), seq2)) #only the best cell is known, the grid is never stored
+    else:
+        grid = (None,score_only(seq1, seq2)) #only the best cell is known, the grid is never stored
+
+    if args.score_only:
+        print('Score:',grid[1][0]) #print the alignment score
+        print('End:',grid[1][1],grid[1][2]) #print the position the alignment ends at in the first and second sequence
+        exit(0)
+    if grid[0] == None:
+        align = get_alignment_window(seq1,seq2,grid[1]) #traceback only the aligned window
+    else:
+        align = get_alignment(grid[0],grid[1],seq1,seq2) #traceback the grid to get the alignment
+    print('Score:',align[1]) #print the alignment score
+    print(format_alignment(align)) #print the alignment properly formated
+
+    #print_grid_space(grid[0], seq1, seq2)
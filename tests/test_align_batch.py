@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+#helper function to run an aligner in batch mode with one worker and return the TSV lines after the header
+def run_batch(tmp_path,script,options,records='>a\nAAAAT\n>b\nTAAAA\n>c\nGGGGGGGG\n'):
+    path = tmp_path / 'records.fa'
+    path.write_text(records)
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),script)
+    result = subprocess.run([sys.executable,script,str(path),'-m','-w','1']+options,capture_output=True,text=True)
+    assert result.returncode == 0
+    return sorted(result.stdout.splitlines()[1:])
+
+#the band given on the command line is used in batch mode, a band of 0 only keeps the main diagonal
+def test_nw_batch_band(tmp_path):
+    full = run_batch(tmp_path,'nw_align.py',[])
+    banded = run_batch(tmp_path,'nw_align.py',['-b','0'])
+    assert full[0].split('\t')[:3] == ['a','b','2']
+    assert banded[0].split('\t')[:3] == ['a','b','1']
+    assert run_batch(tmp_path,'nw_align.py',['-l']) == full
+    assert run_batch(tmp_path,'nw_align.py',['-e','grid']) == full
+
+#the engine and prefilter given on the command line are used in batch mode, pairs without enough seed hits are left out
+def test_sw_batch_engine_and_prefilter(tmp_path):
+    records = '>a\nGATTACAGATTACAGG\n>b\nCCGATTACAGATTACA\n>c\nTGCTGCTGCTGCTGCT\n'
+    full = run_batch(tmp_path,'sw_align.py',[],records)
+    assert len(full) == 3
+    for engine in ('grid','numpy','stream','striped'):
+        assert run_batch(tmp_path,'sw_align.py',['-e',engine],records) == full
+    seeded = run_batch(tmp_path,'sw_align.py',['-f','--sensitivity','sensitive'],records)
+    assert [i.split('\t')[:2] for i in seeded] == [['a','b']]
@@ -0,0 +1,32 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+#helper function to start sw_align.py --serve and wait until its socket accepts connections
+def start_server(socket_path):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'sw_align.py')
+    process = subprocess.Popen([sys.executable,script,'--serve',socket_path],stderr=subprocess.DEVNULL)
+    for i in range(0,200):
+        if os.path.exists(socket_path):
+            return process
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('The server did not start')
+
+#SIGTERM stops the server and removes its socket so the next server starts on the same path
+def test_sigterm_removes_socket(tmp_path):
+    socket_path = str(tmp_path / 'align.sock')
+    for i in range(0,2):
+        process = start_server(socket_path)
+        client = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        client.connect(socket_path)
+        client.sendall(b'{"seq1": "ACGT", "seq2": "ACGT"}\n')
+        assert json.loads(client.makefile('rb').readline())['score'] == 4
+        client.close()
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+        assert not os.path.exists(socket_path)
@@ -0,0 +1,107 @@
+import gzip
+import random
+import struct
+import zlib
+import all2fasta
+import bgzf
+import fasta_index
+
+#compressed input is named like the uncompressed file, the compression extension is removed before the format extension
+def test_compressed_output_name(tmp_path):
+    path = tmp_path / 'reads.fastq.gz'
+    with gzip.open(str(path),'wt') as file:
+        file.write('@read1\nACGT\n+\nIIII\n@read2\nGGCC\n+\nIIII\n')
+    assert all2fasta.convert_file(str(path)) == str(tmp_path / 'reads.fna')
+    assert (tmp_path / 'reads.fna').read_text() == '>read1\nACGT\n>read2\nGGCC\n'
+
+#haploid samples give one record each, diploid samples one record per haplotype (phased or not) with the alleles in the order they are written
+def test_vcf_haplotype_records():
+    header = ['##fileformat=VCFv4.2','#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS\tT']
+    haploid = header + ['1\t1\t.\tA\tG\t.\t.\t.\tGT\t1\t0','1\t2\t.\tC\tT,G\t.\t.\t.\tGT\t2\t.']
+    assert list(all2fasta.parse_vcf(haploid)) == [('1','AC'),('S','GG'),('T','AN')]
+    diploid = header + ['1\t1\t.\tA\tG\t.\t.\t.\tGT\t0/1\t1|1','1\t2\t.\tC\tT,G\t.\t.\t.\tGT\t2/0\t0|.']
+    assert list(all2fasta.parse_vcf(diploid)) == [('1','AC'),('S_1','AG'),('S_2','GC'),('T_1','GC'),('T_2','GN')]
+
+#helper function to write a fastq file with reads of random length, long enough to fill several BGZF blocks
+def write_random_fastq(path,rand):
+    lines = []
+    for i in range(0,150):
+        sequence = ''.join(rand.choice('ACGT') for j in range(0,rand.choice([1,rand.randint(2,69),rand.randint(70,5000)])))
+        lines.append('@read'+str(i)+' sample\n'+sequence+'\n+\n'+'I'*len(sequence)+'\n')
+    path.write_text(''.join(lines))
+
+#gzip and BGZF output decompress to the uncompressed output, the .fai entries match an index built from the decompressed fasta and every block of
+#the .gzi index starts a BGZF block holding the bytes at its uncompressed offset
+def test_compressed_output_round_trip(tmp_path):
+    path = tmp_path / 'reads.fastq'
+    write_random_fastq(path,random.Random(17))
+    plain = all2fasta.convert_file(str(path),fold=60)
+    with open(plain,'rb') as file:
+        data = file.read()
+    assert len(data) > 2*bgzf.BGZF_BLOCK_SIZE
+    for compress in ('gzip','bgzf'):
+        output = all2fasta.convert_file(str(path),fold=60,compress=compress,threads=2,index=True,file_name=str(tmp_path / ('reads.'+compress+'.fna.gz')))
+        with gzip.open(output,'rb') as file:
+            assert file.read() == data
+        with open(output+'.fai','r') as file:
+            entries = [[i[0]]+[int(j) for j in i[1:]] for i in (line.rstrip('\n').split('\t') for line in file)]
+        assert entries == fasta_index.build_index(data)
+        if compress == 'bgzf':
+            with open(output,'rb') as file:
+                compressed = file.read()
+            assert compressed.endswith(bgzf.BGZF_EOF)
+            with open(output+'.gzi','rb') as file:
+                gzi = file.read()
+            count = struct.unpack_from('<Q',gzi,0)[0]
+            assert count > 1 and len(gzi) == 8+16*count
+            for i in range(0,count):
+                compressed_offset,uncompressed_offset = struct.unpack_from('<QQ',gzi,8+16*i)
+                block = zlib.decompressobj(31).decompress(compressed[compressed_offset:])
+                assert len(block) > 0 and data[uncompressed_offset:uncompressed_offset+len(block)] == block
+
+#helper function to encode one BAM alignment record, sequences are packed 2 bases per byte with the BAM base codes
+def bam_record(name,flag,mapq,sequence,cigar_count=1):
+    name = name.encode('ascii')+b'\0'
+    codes = [all2fasta.BAM_BASES.index(i) for i in sequence] + [0]
+    packed = bytes(codes[i]<<4 | codes[i+1] for i in range(0,len(sequence),2))
+    data = all2fasta.BAM_RECORD.pack(0,100,len(name),mapq,4680,cigar_count,flag,len(sequence),-1,-1,0)
+    data += name + struct.pack('<I',len(sequence)<<4)*cigar_count + packed + b'\xff'*len(sequence)
+    return struct.pack('<i',len(data)) + data
+
+#helper function to write a BAM file with a header, one reference and the given records as BGZF blocks (or one gzip member)
+def write_bam(path,records,compress='bgzf'):
+    text = b'@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:1000\n'
+    data = b'BAM\x01' + struct.pack('<i',len(text)) + text + struct.pack('<ii',1,5) + b'chr1\0' + struct.pack('<i',1000) + b''.join(records)
+    with open(str(path),'wb') as file:
+        if compress == 'bgzf':
+            file.write(bgzf.compress_bgzf_block(data[:40]) + bgzf.compress_bgzf_block(data[40:]) + bgzf.BGZF_EOF) #header split over 2 blocks
+        else:
+            file.write(gzip.compress(data))
+
+#BAM records are decoded with their names and sequences (odd lengths and empty sequences included), the flag and MAPQ filters drop reads before
+#they are decoded and reads on the reverse strand are reverse complemented on request
+def test_bam_decoding_and_filters(tmp_path):
+    path = tmp_path / 'reads.bam'
+    records = [bam_record('r1',0,60,'ACGTN'),bam_record('r2',16,30,'AACGT',2),bam_record('r3',4,0,'GGG',0),bam_record('r4',0,0,'',0)]
+    expected = [('r1','ACGTN'),('r2','AACGT'),('r3','GGG'),('r4','*')]
+    for compress in ('bgzf','gzip'):
+        write_bam(path,records,compress)
+        assert all2fasta.is_bam(str(path))
+
+        #helper function to decode the BAM file with the given options
+        def decode(**options):
+            file = bgzf.open_binary(str(path))
+            try:
+                return list(all2fasta.parse_bam(file,**options))
+            finally:
+                file.close()
+        assert decode() == expected
+        assert decode(exclude_flags=4) == [expected[0],expected[1],expected[3]]
+        assert decode(include_flags=16) == [expected[1]]
+        assert decode(min_mapq=30) == expected[:2]
+        assert decode(include_flags=16,reverse_complement=True) == [('r2','ACGTT')]
+        assert decode(exclude_flags=16,min_mapq=1,reverse_complement=True) == [expected[0]]
+    output = all2fasta.convert_file(str(path),bam_options={'min_mapq':1,'reverse_complement':True})
+    assert output == str(tmp_path / 'reads.fna')
+    assert (tmp_path / 'reads.fna').read_text() == '>r1\nACGTN\n>r2\nACGTT\n'
+    assert not all2fasta.is_bam(str(tmp_path / 'reads.fna'))
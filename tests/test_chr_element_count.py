@@ -0,0 +1,38 @@
+import io
+import subprocess
+import sys
+import chr_element_count
+
+#helper function to run the serial mode on a BED file and return the printed regions
+def serial_output(path):
+    file = open(path,'r')
+    out = io.StringIO()
+    for i in chr_element_count.parse_occurences(chr_element_count.read_intervals(file)):
+        chr_element_count.write_occurences(out,*i)
+    file.close()
+    return out.getvalue()
+
+#blank lines and a trailing newline used to make the partition pass loop forever
+def test_parallel_blank_lines(tmp_path):
+    path = tmp_path / 'blank.bed'
+    path.write_text('chr1\t1\t10\n\nchr2\t3\t4\n\n\nchr1\t5\t20\n\n')
+    out = io.StringIO()
+    chr_element_count.parallel_coverage(str(path),out,2)
+    assert out.getvalue() == 'chr1\t1\t5\t1\nchr1\t5\t10\t2\nchr1\t10\t20\t1\nchr2\t3\t4\t1\n'
+    assert out.getvalue() == serial_output(str(path))
+
+def test_parallel_trailing_newline(tmp_path):
+    path = tmp_path / 'trailing.bed'
+    path.write_text('chr1\t1\t10\nchr1\t5\t20\n\n')
+    out = io.StringIO()
+    chr_element_count.parallel_coverage(str(path),out,2)
+    assert out.getvalue() == 'chr1\t1\t5\t1\nchr1\t5\t10\t2\nchr1\t10\t20\t1\n'
+
+#an unsorted file stops the streaming mode with an error on stderr and no regions written after it
+def test_stream_unsorted_error(tmp_path):
+    path = tmp_path / 'unsorted.bed'
+    path.write_text('chr1\t10\t20\nchr1\t5\t8\n')
+    result = subprocess.run([sys.executable,chr_element_count.__file__,'-s','-i',str(path)],capture_output=True,text=True)
+    assert result.returncode == 1
+    assert result.stdout == ''
+    assert 'not sorted' in result.stderr
@@ -0,0 +1,53 @@
+import random
+import numpy as np
+import chr_element_count
+import coverage_track
+
+#helper function to write a coverage track of random intervals on 2 chromosomes, returns the per base coverage array of every chromosome
+def write_random_track(path,rand,block_size,zoom_levels):
+    intervals = {}
+    coverage = {}
+    for name,count in (('chr1',400),('chr2',3)):
+        starts = np.array([rand.randint(0,3000) for i in range(0,count)],dtype=np.int64)
+        ends = starts + np.array([rand.choice([0,rand.randint(1,30),rand.randint(1,300)]) for i in range(0,count)],dtype=np.int64)
+        intervals[name] = (starts,ends)
+        depth = np.zeros(8000,dtype=np.int64) #longer than every range queried
+        for i in range(0,count):
+            depth[starts[i]:ends[i]] += 1
+        coverage[name] = depth
+    coverage_track.write_track(str(path),chr_element_count.parse_occurences(intervals),zoom_levels,block_size)
+    return coverage
+
+#depth, mean, max and zoom bins of the track match the per base coverage, the small blocks make most ranges cross a block boundary
+def test_track_matches_coverage(tmp_path):
+    rand = random.Random(11)
+    path = tmp_path / 'coverage.track'
+    coverage = write_random_track(path,rand,4,(7,100))
+    track = coverage_track.CoverageTrack(str(path))
+    for name,depth in coverage.items():
+        end = int(np.nonzero(depth)[0][-1])+1
+        assert track.get_length(name) == end
+        for position in range(-1,end+10):
+            assert track.get_depth(name,position) == (depth[position] if position >= 0 else 0)
+        ranges = [(None,None),(0,1),(end-1,end+50)] + [(rand.randint(0,end),None) for i in range(0,5)]
+        for i in range(0,300):
+            begin = rand.randint(0,end+20)
+            ranges.append((begin,begin+rand.randint(1,rand.choice([5,50,3000]))))
+        for begin,stop in ranges:
+            first = 0 if begin == None else begin
+            last = end if stop == None else stop
+            if last <= first:
+                continue
+            mean,maximum = track.get_summary(name,begin,stop)
+            assert abs(mean - depth[first:last].mean()) < 1e-9
+            assert maximum == depth[first:last].max()
+        for bin_size in (7,100):
+            bin_starts,means,maxima = track.get_zoom(name,bin_size)
+            assert list(bin_starts) == list(range(0,end,bin_size))
+            for i in range(0,len(bin_starts)):
+                values = depth[bin_starts[i]:min(bin_starts[i]+bin_size,end)]
+                assert abs(means[i] - values.mean()) < 1e-4
+                assert maxima[i] == values.max()
+            bin_starts,means,maxima = track.get_zoom(name,bin_size,bin_size+3,5*bin_size+1)
+            assert list(bin_starts) == [i*bin_size for i in range(1,min(6,len(range(0,end,bin_size))))]
+    track.close()
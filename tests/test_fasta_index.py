@@ -0,0 +1,25 @@
+import fasta_index
+import nw_align
+import sw_align
+
+#a record wrapped at different line lengths can not be indexed, it is still read like before the index was added
+def test_irregular_line_lengths(tmp_path):
+    path = tmp_path / 'irregular.fa'
+    path.write_text('>a\nACGTACGT\nACG\nACGTAC\n>b\nTT\nTTT\n')
+    for module in (nw_align,sw_align):
+        assert module.read_sequence(str(path)) == ' ACGTACGTACGACGTAC'
+        assert module.read_sequence(str(path),'a:3-10') == ' GTACGTAC'
+        assert module.read_sequence(str(path),'b') == ' TTTTT'
+
+#blank lines between the header and the first bases are skipped, the offset points at the first sequence line
+def test_blank_line_after_header(tmp_path):
+    path = tmp_path / 'blank.fa'
+    path.write_text('>a\n\nACGTAC\nGGTT\n>b\n\r\n\nTTGA\n')
+    index = fasta_index.FastaIndex(str(path))
+    assert index.fetch('a') == b'ACGTACGGTT'
+    assert index.fetch('a',4,8) == b'ACGG'
+    assert index.fetch('b') == b'TTGA'
+    index.close()
+    for module in (nw_align,sw_align):
+        assert module.read_sequence(str(path)) == ' ACGTACGGTT'
+        assert module.read_sequence(str(path),'b') == ' TTGA'
@@ -0,0 +1,28 @@
+import random
+import nw_align
+
+#helper function to generate a pair with a long insertion in one sequence and a long deletion in the other, so the best path leaves the starting band
+def indel_pair(rand,letters):
+    seq1 = ''.join(rand.choice(letters) for i in range(0,rand.randint(20,300)))
+    seq2 = ''.join(c if rand.random() < 0.9 else rand.choice(letters) for c in seq1)
+    insert = rand.randint(0,len(seq2))
+    seq2 = seq2[:insert] + ''.join(rand.choice(letters) for i in range(0,rand.randint(0,150))) + seq2[insert:]
+    delete = rand.randint(0,len(seq2))
+    seq2 = seq2[:delete] + seq2[delete+rand.randint(0,100):]
+    return (seq1,seq2) if rand.random() < 0.5 else (seq2,seq1)
+
+#the automatic band gives the same score as the full grid, including pairs whose starting band does not hold the best path
+def test_band_same_score_as_full_grid():
+    rand = random.Random(13)
+    widened = 0
+    for i in range(0,80):
+        seq1,seq2 = indel_pair(rand,rand.choice(['ACGT','ACDEFGHIKLMNPQRSTVWY']))
+        full = nw_align.align_global(seq1,seq2)
+        banded = nw_align.align_global(seq1,seq2,band='auto')
+        assert banded['score'] == full['score']
+        assert banded['aligned1'].replace('-','') == seq1 and banded['aligned2'].replace('-','') == seq2
+        band = max(nw_align.BAND_MIN,abs(len(seq1)-len(seq2)))
+        grid = nw_align.fill_grid_banded(' '+seq1,' '+seq2,band)
+        if grid[len(grid)-1][grid.cols-1][0] < full['score']:
+            widened += 1
+    assert widened > 0
@@ -0,0 +1,50 @@
+import os
+import random
+import subprocess
+import sys
+
+#helper function to write random intervals of a few chromosomes as a BED file, long intervals contain many short ones and some have no length
+def write_random_bed(path,rand,count):
+    lines = []
+    for i in range(0,count):
+        start = rand.randint(0,2000)
+        length = rand.choice([0,rand.randint(1,20),rand.randint(1,200),rand.randint(500,2000)])
+        lines.append(rand.choice(['chr1','chr2','chr3'])+'\t'+str(start)+'\t'+str(start+length)+'\n')
+    path.write_text(''.join(lines))
+
+#helper function to read the intervals of a BED file per chromosome sorted by position like open_bed
+def read_bed(path):
+    intervals = {}
+    for line in path.read_text().splitlines():
+        fields = line.split('\t')
+        intervals.setdefault(fields[0],[]).append((int(fields[1]),int(fields[2])))
+    for i in intervals.keys():
+        intervals[i].sort()
+    return intervals
+
+#helper function to get the joined output lines by comparing every interval of the first file with every interval of the second one
+def brute_force(input1,input2,match):
+    lines = []
+    for i in input1.keys():
+        for j in input1[i]:
+            length = j[1]-j[0]
+            if length <= 0:
+                continue
+            for k in input2.get(i,[]):
+                overlap = min(j[1],k[1])-max(j[0],k[0])
+                if overlap > 0 and overlap/length*100 >= match:
+                    lines.append(i+'\t'+str(j[0])+'\t'+str(j[1])+'\t'+i+'\t'+str(k[0])+'\t'+str(k[1])+'\t')
+    return lines
+
+#the interval tree finds the same overlaps in the same order as comparing every pair of intervals
+def test_same_overlaps_as_brute_force(tmp_path):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'overlap_bed.py')
+    rand = random.Random(7)
+    for count1,count2 in ((300,500),(50,1),(200,0),(400,2000)):
+        write_random_bed(tmp_path / 'a.bed',rand,count1)
+        write_random_bed(tmp_path / 'b.bed',rand,count2)
+        input1 = read_bed(tmp_path / 'a.bed')
+        input2 = read_bed(tmp_path / 'b.bed')
+        for match in (0,50,100):
+            subprocess.run([sys.executable,script,'-i1','a.bed','-i2','b.bed','-m',str(match),'-o','out.bed','-j'],cwd=str(tmp_path),check=True)
+            assert (tmp_path / 'out.bed').read_text().splitlines() == brute_force(input1,input2,match)
@@ -0,0 +1,52 @@
+import random
+import sw_align
+
+#helper function to get the parts of a local alignment that must not depend on the engine
+def alignment_key(result):
+    return (result['score'],result['start1'],result['end1'],result['start2'],result['end2'],result['aligned1'],result['aligned2'])
+
+#every engine returns the same begin coordinates and aligned strings as the original grid, including the cells with a score of 0 the grid
+#traceback keeps going through
+def test_engines_same_alignment():
+    pairs = [('GTATTCTATGATGGTCCCCAAGCTT','GATATTCTATGATGGTCCCAAGCTT')]
+    rand = random.Random(1)
+    for i in range(0,60):
+        letters = rand.choice(['ACGT','ACDEFGHIKLMNPQRSTVWY'])
+        pairs.append((''.join(rand.choice(letters) for j in range(rand.randint(1,60))),''.join(rand.choice(letters) for j in range(rand.randint(1,60)))))
+    for seq1,seq2 in pairs:
+        reference = alignment_key(sw_align.align_local(seq1,seq2,engine='grid'))
+        for engine in ('numpy','stream','striped','auto'):
+            assert alignment_key(sw_align.align_local(seq1,seq2,engine=engine)) == reference
+
+#helper function to generate a pair of random sequences sharing a mutated domain
+def domain_pair(rand,letters):
+    domain = ''.join(rand.choice(letters) for i in range(0,rand.randint(50,200)))
+    mutated = ''.join(c if rand.random() < 0.85 else rand.choice(letters) for c in domain)
+    seq1 = ''.join(rand.choice(letters) for i in range(0,rand.randint(50,600))) + domain + ''.join(rand.choice(letters) for i in range(0,rand.randint(0,300)))
+    seq2 = ''.join(rand.choice(letters) for i in range(0,rand.randint(50,600))) + mutated + ''.join(rand.choice(letters) for i in range(0,rand.randint(0,300)))
+    return (' ' + seq1,' ' + seq2)
+
+#pairs passing the seed prefilter get the same score and end cell as the full grid
+def test_seeded_score_exact():
+    rand = random.Random(3)
+    for letters in ('ACGT','ACDEFGHIKLMNPQRSTVWY'):
+        for i in range(0,20):
+            seq1,seq2 = domain_pair(rand,letters)
+            start = sw_align.seeded_score(seq1,seq2)
+            if start != None:
+                assert start == sw_align.score_only(seq1,seq2)
+
+#a pair passing the prefilter on a short exact seed while its best alignment is a long region with a mismatch every 4 residues (no 4-mer seed)
+def test_seeded_score_unseeded_alignment():
+    rand = random.Random(5)
+    letters = 'ACDEFGHIKLMNPQRSTVWY'
+    random_protein = lambda n: ''.join(rand.choice(letters) for i in range(0,n))
+    seed = random_protein(20)
+    region = random_protein(200)
+    mutated = ''.join(rand.choice(letters.replace(region[i],'')) if i % 4 == 3 else region[i] for i in range(0,len(region)))
+    seq1 = ' ' + random_protein(100) + seed + random_protein(200) + region + random_protein(100)
+    seq2 = ' ' + random_protein(150) + seed + random_protein(150) + mutated + random_protein(100)
+    full = sw_align.score_only(seq1,seq2)
+    assert full[0] > 20
+    for sensitivity in ('fast','default'):
+        assert sw_align.seeded_score(seq1,seq2,sensitivity) == full